@@ -16,96 +16,223 @@
 # limitations under the License.
 import logging
 import os
+import sys
+import fnmatch
+import signal
+import threading
 import click
 import spillman as s
 from datetime import date, timedelta
 from datetime import datetime
-from spillman.database import db
 from spillman.settings import settings_data
 
 logging.basicConfig(
     format="%(levelname)s - %(message)s",
     level=settings_data["global"]["loglevel"],
-    filename="spillman-etl.log",
 )
 
+fact_tables = [
+    "cad",
+    "fireincident",
+    "emsincident",
+    "lawincident",
+    "rlog",
+    "citation",
+    "msglog",
+    "avl",
+]
+
+reference_tables = [
+    "apagncy",
+    "apcity",
+    "apnames",
+    "syunit",
+    "cdnatunt",
+    "cdoffst",
+    "cdstatn",
+    "cdunit",
+    "hmcbase",
+    "hmccas",
+    "hmcnam",
+    "rumain",
+    "rutypes",
+    "tbakaknd",
+    "tbhowrc",
+    "tbnataka",
+    "tbnatur",
+    "tbvehaka",
+    "tbvehknd",
+    "tbxnames",
+    "tbzones",
+]
+
 
 @click.group()
 def main():
     """Spillman ETL"""
 
 
+def run_extracts(start_date, end_date, workers, force=()):
+    dates = list(s.functions.daterange(start_date, end_date))
+    logging.info(f"Running Spillman-ETL for {len(dates)} days from {start_date}")
+    tasks = s.facts.extract_tasks(fact_tables, dates, force)
+
+    if not s.spool.spool_enabled:
+        return s.runner.run(tasks, workers)
+
+    # Extractors write to the spool while loader threads drain it into the
+    # warehouse, each at its own pace.
+    with s.spool.draining() as loaded:
+        results = s.runner.run(tasks, workers)
+    return results + loaded
+
+
+def run_backfill(start_date, end_date, workers, processes, chunk_days, force):
+    # Worker processes extract; with the spool on, this process loads.
+    args = (fact_tables, start_date, end_date, processes, chunk_days, workers, force)
+    if not s.spool.spool_enabled:
+        return s.backfill.backfill_range(*args)
+
+    with s.spool.draining() as loaded:
+        results = s.backfill.backfill_range(*args)
+    return results + loaded
+
+
+def check_results(results):
+    if any(result["status"] != "ok" for result in results):
+        sys.exit(1)
+
+
 @main.command()
-def daily():
+@click.option("--workers", type=int, help="Number of extractors to run at once")
+@click.option("--replay", is_flag=True, help="Read Spillman responses from the cache")
+@click.option("--bulk/--no-bulk", default=None, help="Load with LOAD DATA INFILE")
+@click.option("--spool/--no-spool", default=None, help="Load through the local spool")
+@click.option("--keyfilter/--no-keyfilter", default=None, help="Skip loaded rows")
+@click.option("--force", multiple=True, help="Redo a completed table or glob")
+@click.option("--datamart/--no-datamart", default=True, help="Rebuild the datamart")
+def daily(workers, replay, bulk, spool, keyfilter, force, datamart):
     """Daily ETL Processing"""
     s.functions.header()
-    start_date = datetime.today() - timedelta(days=1)
-    end_date = datetime.today() - timedelta(days=0)
-
-    for single_date in s.functions.daterange(start_date, end_date):
-        process_date = single_date.strftime("%Y-%m-%d")
-        logging.info(f"Running Spillman-ETL for {process_date}")
-
-        s.cad.extract(process_date)
-        s.fireincident.extract(process_date)
-        s.emsincident.extract(process_date)
-        s.lawincident.extract(process_date)
-        s.rlog.extract(process_date)
-        s.citation.extract(process_date)
-        s.msglog.extract(process_date)
-        s.avl.extract(process_date)
-
-        tables = [
-            "apagncy",
-            "apcity",
-            "apnames",
-            "syunit",
-            "cdnatunt",
-            "cdoffst",
-            "cdstatn",
-            "cdunit",
-            "hmcbase",
-            "hmccas",
-            "hmcnam",
-            "rumain",
-            "rutypes",
-            "tbakaknd",
-            "tbhowrc",
-            "tbnataka",
-            "tbnatur",
-            "tbvehaka",
-            "tbvehknd",
-            "tbxnames",
-            "tbzones",
-        ]
-
-        for table in tables:
-            s.table.spillman(table)
+    s.cache.set_replay(replay)
+    s.loadtable.set_bulk(bulk)
+    s.spool.set_spool(spool)
+    s.keyindex.set_keyfilter(keyfilter)
+    process_date = datetime.today() - timedelta(days=1)
+
+    tasks = daily_tasks(process_date, force, datamart)
+    if not s.spool.spool_enabled:
+        results = s.scheduler.schedule(tasks, workers)
+    else:
+        with s.spool.draining() as loaded:
+            results = s.scheduler.schedule(tasks, workers)
+        results += loaded
+
+    check_results(results)
+
+
+def daily_tasks(process_date, force, datamart):
+    # Extracts the datamart reads go first, and each procedure starts as
+    # soon as they are loaded instead of after the whole daily run.
+    Task = s.scheduler.Task
+    extracts = s.facts.extract_tasks(fact_tables, [process_date], force)
+    extracts.sort(key=lambda task: task[2][0] not in s.datamart.daily_inputs)
+    tasks = [Task(name, func, args, uses=("api",)) for name, func, args in extracts]
+
+    inputs = [f"{table} {process_date:%Y-%m-%d}" for table in s.datamart.daily_inputs]
+    if s.spool.spool_enabled:
+        # Extracts only spool their rows; load them before the procedures.
+        tasks.append(Task("load spool", s.spool.load_spooled, after=inputs))
+        inputs = ["load spool"]
+    if datamart:
+        tasks.extend(
+            Task(
+                procedure,
+                s.datamart.runProcedure,
+                (procedure,),
+                after=inputs,
+                uses=("datamart",),
+            )
+            for procedure in s.datamart.daily_procedures
+        )
+
+    tasks.extend(
+        Task(f"table {table}", s.table.spillman, (table,), uses=("api",))
+        for table in reference_tables
+    )
+    return tasks
 
 
 @main.command()
 @click.option("--start", type=str, help="Start date (YYYY-MM-DD)")
 @click.option("--end", type=str, help="End date (YYYY-MM-DD)")
-def history(start, end):
+@click.option("--workers", type=int, help="Number of extractors to run at once")
+@click.option("--replay", is_flag=True, help="Read Spillman responses from the cache")
+@click.option("--bulk/--no-bulk", default=None, help="Load with LOAD DATA INFILE")
+@click.option("--spool/--no-spool", default=None, help="Load through the local spool")
+@click.option("--keyfilter/--no-keyfilter", default=None, help="Skip loaded rows")
+@click.option("--processes", type=int, help="Worker processes for a parallel backfill")
+@click.option("--chunk-days", type=int, help="Days per backfill chunk")
+@click.option("--force", multiple=True, help="Redo a completed table or glob")
+def history(
+    start, end, workers, replay, bulk, spool, keyfilter, processes, chunk_days, force
+):
     """Historical ETL Processing"""
     s.functions.header()
+    s.cache.set_replay(replay)
+    s.loadtable.set_bulk(bulk)
+    s.spool.set_spool(spool)
+    s.keyindex.set_keyfilter(keyfilter)
     logging.info(f"Running Spillman-ETL history from {start} to {end}")
 
     start_date = datetime.strptime(start, "%Y-%m-%d").date()
     end_date = datetime.strptime(end, "%Y-%m-%d").date()
 
-    for single_date in s.functions.daterange(start_date, end_date):
-        process_date = single_date.strftime("%Y-%m-%d")
-        logging.info(f"Running Spillman-ETL for {process_date}")
+    if (processes or s.backfill.backfill_processes) > 1:
+        results = run_backfill(
+            start_date, end_date, workers, processes, chunk_days, force
+        )
+    else:
+        results = run_extracts(start_date, end_date, workers, force)
+    check_results(results)
+
+
+@main.command()
+@click.option("--table", multiple=True, help="Mapping to poll; repeatable")
+@click.option("--poll", type=int, help="Seconds between polls")
+@click.option("--spool/--no-spool", default=None, help="Load through the local spool")
+@click.option("--keyfilter/--no-keyfilter", default=None, help="Skip loaded rows")
+def stream(table, poll, spool, keyfilter):
+    """Continuously Load New Rows"""
+    s.functions.header()
+    s.spool.set_spool(spool)
+    s.keyindex.set_keyfilter(keyfilter)
+    unfiltered = s.stream.unfiltered(table)
+    if unfiltered:
+        raise click.UsageError(
+            f"{', '.join(unfiltered)} cannot be streamed without the key filter"
+        )
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+
+    if not s.spool.spool_enabled:
+        s.stream.follow(table, poll, stop)
+        return
+    with s.spool.draining():
+        s.stream.follow(table, poll, stop)
+
 
-        s.cad.extract(process_date)
-        s.fireincident.extract(process_date)
-        s.emsincident.extract(process_date)
-        s.lawincident.extract(process_date)
-        s.rlog.extract(process_date)
-        s.citation.extract(process_date)
-        s.msglog.extract(process_date)
-        s.avl.extract(process_date)
+@main.command()
+@click.option("--workers", type=int, help="Number of loader threads")
+@click.option("--bulk/--no-bulk", default=None, help="Load with LOAD DATA INFILE")
+def drain(workers, bulk):
+    """Load Spooled Rows into the Warehouse"""
+    s.functions.header()
+    s.loadtable.set_bulk(bulk)
+    results = s.spool.drain(workers)
+    check_results(results)
 
 
 @main.command()
@@ -113,14 +240,17 @@ def ddm():
     """Daily DataMart Process"""
     s.functions.header()
     logging.info(f"Executing Daily DataMart Stored Procedures")
-    s.datamart.daily()
+    results = s.datamart.daily()
+    check_results(results)
 
 
 @main.command()
-def geobase():
+@click.option("--workers", type=int, help="Number of address pages to load at once")
+def geobase(workers):
     """Update Geobase Table"""
     s.functions.header()
-    s.geobase.extract()
+    results = s.geobase.extract(workers)
+    check_results(results)
 
 
 @main.command()
@@ -132,12 +262,53 @@ def createagency(agency, type):
     s.agencyview.create(agency, type)
 
 
+def table_names(tables, table_file):
+    # Names from --table (plain or glob patterns matched against the
+    # reference tables) and from a list file with one table per line.
+    names = []
+    for table in tables:
+        if any(c in table for c in "*?["):
+            names.extend(fnmatch.filter(reference_tables, table))
+        else:
+            names.append(table)
+    if table_file:
+        with open(table_file, "r") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    names.append(line)
+    return list(dict.fromkeys(names))
+
+
 @main.command()
-@click.option("--table", type=str, help="Specify the Spillman Table")
-def tableimport(table):
+@click.option("--table", multiple=True, help="Spillman table or glob; repeatable")
+@click.option("--file", "table_file", type=str, help="File listing tables to copy")
+@click.option("--workers", type=int, help="Number of tables to import at once")
+@click.option("--replay", is_flag=True, help="Read Spillman responses from the cache")
+@click.option("--full", is_flag=True, help="Rebuild the table instead of syncing it")
+def tableimport(table, table_file, workers, replay, full):
     """Copy Entire Spillman Tables"""
     s.functions.header()
-    s.table.spillman(table)
+    s.cache.set_replay(replay)
+    tables = table_names(table, table_file)
+    if not tables:
+        raise click.UsageError("No tables given; use --table or --file")
+    results = s.table.import_tables(tables, full, workers)
+    check_results(results)
+
+
+@main.command()
+@click.option("--host", type=str, default="127.0.0.1", help="Address to listen on")
+@click.option("--port", type=int, default=8080, help="Port to listen on")
+@click.option("--seed", type=int, default=1, help="Seed for the synthetic data")
+@click.option("--latency", type=float, default=0, help="Seconds to wait per query")
+@click.option("--page-size", type=int, default=500, help="Rows per response chunk")
+@click.option("--rows", multiple=True, help="Rows per day for a table (TABLE=N)")
+def simulate(host, port, seed, latency, page_size, rows):
+    """Serve Synthetic Data as a Local Spillman API"""
+    s.functions.header()
+    rows = dict((table, int(count)) for table, count in (r.split("=") for r in rows))
+    s.simulator.serve(host, port, seed, rows, latency, page_size)
 
 
 if __name__ == "__main__":
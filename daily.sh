@@ -1,4 +1,3 @@
 #!/bin/bash
 cd /opt/spillman-etl
-/usr/bin/python3 /opt/spillman-etl/app.py daily
-/usr/bin/python3 /opt/spillman-etl/app.py ddm
\ No newline at end of file
+/usr/bin/python3 /opt/spillman-etl/app.py daily
\ No newline at end of file
@@ -23,13 +23,11 @@ import spillman as s
 from multiprocessing import Process
 from datetime import date, timedelta
 from datetime import datetime
-from spillman.database import db
 from spillman.settings import settings_data
 
 logging.basicConfig(
     format="%(levelname)s - %(message)s",
     level=settings_data["global"]["loglevel"],
-    filename="spillman-etl-history.log",
 )
 
 
@@ -46,5 +44,4 @@ logging.info("        |_|
 logging.info(f"Running Spillman-ETL Geobase")
 
 s.geobase.extract()
-db.close()
 exit(0)
@@ -1,4 +1,5 @@
 """SPILLMAN."""
+
 # **********************************************************
 # * CATEGORY  SOFTWARE
 # * GROUP     DISPATCH/WAREHOUSING
@@ -15,19 +16,52 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from .database import *
-from .cad import *
-from .emsincident import *
-from .fireincident import *
-from .lawincident import *
-from .loadtable import *
-from .rlog import *
-from .sylog import *
-from .citation import *
-from .msglog import *
-from .avl import *
-from .geobase import *
-from .datamart import *
-from .functions import *
-from .agencyview import *
-from .table import *
+import importlib
+
+# Modules are imported on first use (PEP 562), so importing the package, or
+# starting the CLI, costs nothing until a command reaches for one.
+__all__ = [
+    "database",
+    "decoder",
+    "cache",
+    "client",
+    "cad",
+    "emsincident",
+    "fireincident",
+    "lawincident",
+    "loadtable",
+    "rlog",
+    "sylog",
+    "citation",
+    "msglog",
+    "avl",
+    "geobase",
+    "datamart",
+    "functions",
+    "agencyview",
+    "table",
+    "mapping",
+    "facts",
+    "runner",
+    "simulator",
+    "state",
+    "windows",
+    "timestamps",
+    "schema",
+    "spool",
+    "keyindex",
+    "checkpoint",
+    "backfill",
+    "scheduler",
+    "stream",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
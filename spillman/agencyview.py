@@ -17,14 +17,9 @@
 import datetime
 import traceback
 import logging
-import requests
 import time
 from .settings import settings_data
-from .database import connect, connect_read
-
-requests.packages.urllib3.disable_warnings(
-    requests.packages.urllib3.exceptions.InsecureRequestWarning
-)
+from .database import connection
 
 logging.basicConfig(
     format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
@@ -34,25 +29,24 @@ logging.basicConfig(
 def runQuery(sql):
     max_retries = 5
     try:
-        db = connect()
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                cursor = db.cursor()
-                cursor.execute(f"{sql}")
-                db.commit()
-                break
-            except Exception as e:
-                retry_count += 1
-                logging.info(f"Retrying ({retry_count}/{max_retries}) Error: {e}")
-                time.sleep(60)
-        if retry_count == max_retries:
-            logging.error(traceback.print_exc())
-        cursor.close()
-        db.close()
-    except Exception as e:
-        cursor.close()
-        db.close()
+        with connection() as db:
+            retry_count = 0
+            while retry_count < max_retries:
+                try:
+                    with db.cursor() as cursor:
+                        cursor.execute(f"{sql}")
+                    db.commit()
+                    break
+                except Exception as e:
+                    retry_count += 1
+                    if retry_count == max_retries:
+                        logging.error(traceback.format_exc())
+                        break
+                    logging.info(f"Retrying ({retry_count}/{max_retries}) Error: {e}")
+                    time.sleep(60)
+                    db.ping(reconnect=True)
+    except Exception:
+        logging.error(traceback.format_exc())
 
 
 def create_view(agency, view, source):
@@ -0,0 +1,154 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import time
+import queue
+import logging
+import multiprocessing
+from datetime import timedelta
+from . import cache, facts, keyindex, loadtable, spool
+from .functions import daterange
+from .runner import run, summary
+from .settings import settings_data
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+backfill_settings = settings_data.get("backfill") or {}
+backfill_processes = backfill_settings.get("processes", 1)
+backfill_chunk_days = backfill_settings.get("chunk_days", 7)
+backfill_tasks_per_child = backfill_settings.get("max_tasks_per_child", 4)
+
+
+def chunks(start_date, end_date, days):
+    # Split [start_date, end_date) into ranges of at most days days.
+    chunk = timedelta(days=days)
+    while start_date < end_date:
+        yield start_date, min(start_date + chunk, end_date)
+        start_date += chunk
+
+
+def chunk_label(start_date, end_date):
+    return f"{start_date:%Y-%m-%d} to {end_date - timedelta(days=1):%Y-%m-%d}"
+
+
+def options():
+    # The runtime switches a worker process has to apply for itself, since
+    # it starts from the settings file and not from this process's state.
+    return {
+        "replay": cache.replay,
+        "bulk": loadtable.bulk,
+        "spool": spool.spool_enabled,
+        "keyfilter": keyindex.keyfilter_enabled,
+    }
+
+
+def apply_options(options):
+    cache.set_replay(options["replay"])
+    loadtable.set_bulk(options["bulk"])
+    spool.set_spool(options["spool"])
+    keyindex.set_keyfilter(options["keyfilter"])
+
+
+def run_chunk(label, tasks, options, workers):
+    # Runs in a worker process, which has its own Spillman session and
+    # warehouse pools. With the spool on, rows are only spooled here and the
+    # parent loads them.
+    apply_options(options)
+    logging.info(f"Worker {os.getpid()} backfilling {label}")
+    return {"chunk": label, "pid": os.getpid(), "results": run(tasks, workers)}
+
+
+def backfill_range(
+    tables,
+    start_date,
+    end_date,
+    processes=None,
+    chunk_days=None,
+    workers=None,
+    force=(),
+):
+    # Extract tables for every day in [start_date, end_date) that has no
+    # checkpoint yet, with chunks of chunk_days days spread over processes
+    # worker processes, each running workers extractors at once. Workers are
+    # replaced after backfill.max_tasks_per_child chunks to cap their memory.
+    processes = processes or backfill_processes
+    chunk_days = chunk_days or backfill_chunk_days
+    tasks = facts.extract_tasks(tables, daterange(start_date, end_date), force)
+
+    pending = {}
+    for chunk_start, chunk_end in chunks(start_date, end_date, chunk_days):
+        window = (chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d"))
+        chunk_tasks = [task for task in tasks if window[0] <= task[2][1] < window[1]]
+        if chunk_tasks:
+            pending[chunk_label(chunk_start, chunk_end)] = chunk_tasks
+    logging.info(
+        f"Backfilling {start_date} to {end_date} in {len(pending)} chunks across {processes} processes"
+    )
+
+    # multiprocessing's Pool rather than ProcessPoolExecutor, whose
+    # max_tasks_per_child needs Python 3.11 and can hang replacing workers.
+    started = time.monotonic()
+    reports = []
+    done = queue.Queue()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(
+        processes, maxtasksperchild=backfill_tasks_per_child or None
+    ) as pool:
+        for label, chunk_tasks in pending.items():
+            pool.apply_async(
+                run_chunk,
+                (label, chunk_tasks, options(), workers),
+                callback=done.put,
+                error_callback=lambda e, label=label: done.put(failed_chunk(label, e)),
+            )
+        while len(reports) < len(pending):
+            reports.append(done.get())
+            logging.info(f"Backfilled {len(reports)} of {len(pending)} chunks")
+
+    return report(reports, time.monotonic() - started)
+
+
+def failed_chunk(label, error):
+    # A chunk that raised in its worker is recorded as one failed task so
+    # the backfill is reported as failed.
+    logging.error(f"Backfill chunk {label} failed: {error}")
+    result = {
+        "name": f"chunk {label}",
+        "status": "failed",
+        "error": str(error),
+        "elapsed": 0,
+    }
+    return {"chunk": label, "pid": None, "results": [result]}
+
+
+def report(reports, elapsed):
+    # One line per chunk, then the usual task summary over every chunk.
+    results = []
+    logging.info("Backfill report:")
+    for chunk in sorted(reports, key=lambda chunk: chunk["chunk"]):
+        failed = sum(result["status"] != "ok" for result in chunk["results"])
+        busy = sum(result["elapsed"] for result in chunk["results"])
+        logging.info(
+            f"  {chunk['chunk']:<26} pid {chunk['pid'] or '-':<8} {len(chunk['results']) - failed:>4} ok {failed:>4} failed {busy:8.1f}s"
+        )
+        results.extend(chunk["results"])
+
+    summary(results)
+    logging.info(f"Backfill wall time: {elapsed:.1f}s")
+    return results
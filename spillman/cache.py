@@ -0,0 +1,191 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+from .settings import settings_data
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+cache_settings = settings_data.get("cache") or {}
+cache_enabled = cache_settings.get("enabled", False)
+cache_dir = cache_settings.get("dir", "./spillman/cache")
+cache_ttl = cache_settings.get("ttl_days", 30) * 86400
+cache_max_bytes = cache_settings.get("max_size_mb", 2048) * 1024 * 1024
+cache_compression = cache_settings.get("compression", "gzip")
+cache_read_size = 64 * 1024
+
+if cache_compression == "zstd" and zstandard is None:
+    logging.warning("zstandard is not installed, caching responses with gzip")
+    cache_compression = "gzip"
+
+replay = False
+_pruned = False
+_prune_lock = threading.Lock()
+
+
+def set_replay(enabled):
+    global replay
+    replay = enabled
+
+
+def cache_key(request):
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+def entry_paths(table, key):
+    table_dir = os.path.join(cache_dir, table)
+    data = [
+        os.path.join(table_dir, f"{key}.xml.{ext}")
+        for ext in ("zst", "gz")
+        if ext != "zst" or zstandard is not None
+    ]
+    return data, os.path.join(table_dir, f"{key}.json")
+
+
+def read(table, request):
+    # Return an iterator over the cached raw response body, or None on a miss.
+    data_paths, meta_path = entry_paths(table, cache_key(request))
+    for path in data_paths:
+        if os.path.exists(path):
+            return _read_chunks(path)
+    return None
+
+
+def _read_chunks(path):
+    with open(path, "rb") as raw:
+        if path.endswith(".zst"):
+            f = zstandard.ZstdDecompressor().stream_reader(raw)
+        else:
+            f = gzip.GzipFile(fileobj=raw, mode="rb")
+        with f:
+            while True:
+                chunk = f.read(cache_read_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def tee(table, request, filters, chunks):
+    # Pass response chunks through unchanged while writing a compressed copy.
+    # The entry only becomes visible once the whole body has been received.
+    prune_once()
+    key = cache_key(request)
+    data_paths, meta_path = entry_paths(table, key)
+    path = data_paths[0] if cache_compression == "zstd" else data_paths[-1]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    raw = open(tmp, "wb")
+    if cache_compression == "zstd":
+        f = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    else:
+        f = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+
+    complete = False
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+        complete = True
+    finally:
+        f.close()
+        raw.close()
+        if complete:
+            os.replace(tmp, path)
+            with open(meta_path, "w") as meta:
+                json.dump({"table": table, "filters": filters or []}, meta, default=str)
+        else:
+            os.remove(tmp)
+
+
+def entries(table):
+    # Metadata of every cached response for a table, used by replay to find
+    # the windows an earlier run actually fetched.
+    table_dir = os.path.join(cache_dir, table)
+    try:
+        names = os.listdir(table_dir)
+    except FileNotFoundError:
+        return []
+
+    found = []
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(table_dir, name), "r") as meta:
+                found.append(json.load(meta))
+        except (OSError, ValueError):
+            continue
+    return found
+
+
+def prune_once():
+    global _pruned
+    with _prune_lock:
+        if not _pruned:
+            _pruned = True
+            prune()
+
+
+def prune():
+    # Drop expired entries, then the oldest ones until the cache fits its size
+    # budget. Metadata files go with their response.
+    if not os.path.isdir(cache_dir):
+        return
+
+    now = time.time()
+    files = []
+    for root, dirs, names in os.walk(cache_dir):
+        for name in names:
+            if name.endswith(".gz") or name.endswith(".zst"):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+
+    files.sort()
+    total = sum(size for mtime, size, path in files)
+    removed = 0
+    for mtime, size, path in files:
+        if now - mtime <= cache_ttl and total <= cache_max_bytes:
+            break
+        _remove_entry(path)
+        total -= size
+        removed += 1
+
+    if removed:
+        logging.info(f"Pruned {removed} cached responses")
+
+
+def _remove_entry(path):
+    meta_path = path.rsplit(".xml.", 1)[0] + ".json"
+    for name in (path, meta_path):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
@@ -14,149 +14,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import sys
-import urllib.request as urlreq
-import json
-import logging
-import requests
-import xmltodict
-import traceback
-import datetime
-from .loadtable import *
-from .settings import settings_data
-from .database import db
-
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-
-logging.basicConfig(
-    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
-)
-
-api_url = settings_data["spillman"]["url"]
-api_usr = settings_data["spillman"]["user"]
-api_pwd = settings_data["spillman"]["password"]
-
-session = requests.Session()
-session.auth = (api_usr, api_pwd)
+from . import facts
 
 
 def extract(date):
-    date_time = datetime.datetime.strptime(date, "%Y-%m-%d")
-    start_date = date_time - datetime.timedelta(seconds=1)
-    end_date = date_time + datetime.timedelta(days=1)
-
-    logging.info(f"Processing CAD Incidents from {start_date} to {end_date}")
-
-    try:
-        headers = {"Content-Type": "application/xml"}
-
-        try:
-            request_cad = f"""
-                <PublicSafetyEnvelope version="1.0">
-                    <PublicSafety id="">
-                        <Query>
-                            <CADMasterCallTable>
-                                <TimeDateReported search_type="greater_than">{start_date}</TimeDateReported>
-                                <TimeDateReported search_type="less_than">{end_date}</TimeDateReported>
-                            </CADMasterCallTable>
-                        </Query>
-                    </PublicSafety>
-                </PublicSafetyEnvelope>
-                 """
-            cad_xml = session.post(
-                api_url, data=request_cad, headers=headers, verify=False
-            )
-            cad_decoded = cad_xml.content.decode("utf-8")
-            cad = json.loads(json.dumps(xmltodict.parse(cad_decoded)))
-            cad = cad["PublicSafetyEnvelope"]["PublicSafety"]["Response"][
-                "CADMasterCallTable"
-            ]
-
-        except Exception as e:
-            error = format(str(e))
-            if error.find("'NoneType'") != -1:
-                logging.info(f"No CAD incidents found")
-                return
-            else:
-                logging.error(traceback.print_exc())
-                return
-
-        for results in cad:
-            callid = results["RecordNumber"]
-
-            try:
-                call_type = results["CallTypeLawFireEMS"]
-            except KeyError:
-                call_type = ""
-
-            try:
-                nature = results["CallNature"]
-            except KeyError:
-                nature = ""
-
-            try:
-                priority = results["CallPriority"]
-            except KeyError:
-                priority = ""
-
-            date = results["TimeDateReported"]
-            occ_date1 = results["TimeDateOccurredEarliest"]
-            occ_date2 = results["TimeDateOccurredLatest"]
-
-            reported = f"{date[15:19]}-{date[9:11]}-{date[12:14]} {date[0:8]}"
-            occur_dt_1 = f"{occ_date1[15:19]}-{occ_date1[9:11]}-{occ_date1[12:14]} {occ_date1[0:8]}"
-            occur_dt_2 = f"{occ_date2[15:19]}-{occ_date2[9:11]}-{occ_date2[12:14]} {occ_date2[0:8]}"
-
-            try:
-                address = results["RespondToAddress"]
-                address = address.replace('"', "")
-                address = address.replace("'", "")
-                address = address.replace(";", "")
-            except KeyError:
-                address = ""
-
-            try:
-                city_cd = results["CityCode"]
-            except KeyError:
-                city_cd = ""
-
-            try:
-                complainant_id = results["ComplainantNameNumber"]
-            except KeyError:
-                complainant_id = ""
-
-            try:
-                received_type = results["HowReceived"]
-            except KeyError:
-                received_type = ""
-
-            try:
-                call_taker = results["CallTaker"]
-            except KeyError:
-                call_taker = ""
-
-            try:
-                emd = results["Determinant"]
-            except KeyError:
-                emd = ""
-
-            load_cad(
-                callid,
-                call_type,
-                nature,
-                priority,
-                reported,
-                occur_dt_1,
-                occur_dt_2,
-                address,
-                city_cd,
-                complainant_id,
-                received_type,
-                call_taker,
-                emd,
-            )
-
-    except Exception as e:
-        logging.error(traceback.print_exc())
+    return facts.extract("cad", date)
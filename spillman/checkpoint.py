@@ -0,0 +1,99 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import fnmatch
+import sqlite3
+import datetime
+from contextlib import closing
+from .settings import settings_data
+from .state import state_path
+
+checkpoint_settings = settings_data.get("checkpoint") or {}
+checkpoint_file = checkpoint_settings.get("file", "checkpoints.sqlite")
+
+# Completed units of work, one row per (task, window) with the rows it
+# loaded, and the high-water marks of incremental loads. Worker threads and
+# backfill processes each open their own connection; SQLite's locking
+# serializes the writes.
+checkpoint_schema = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    task TEXT NOT NULL,
+    "window" TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    completed TEXT NOT NULL,
+    PRIMARY KEY (task, "window")
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    task TEXT PRIMARY KEY,
+    mark TEXT NOT NULL,
+    updated TEXT NOT NULL
+);
+"""
+
+
+def connect():
+    db = sqlite3.connect(state_path(checkpoint_file), timeout=60)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(checkpoint_schema)
+    return db
+
+
+def completed(windows):
+    # The (task, window) pairs already completed for any of windows.
+    windows = list(windows)
+    done = set()
+    with closing(connect()) as db:
+        for start in range(0, len(windows), 500):
+            part = windows[start : start + 500]
+            done.update(
+                db.execute(
+                    f'SELECT task, "window" FROM checkpoints WHERE "window" IN ({", ".join("?" * len(part))})',
+                    part,
+                )
+            )
+    return done
+
+
+def mark_complete(task, window, rows):
+    with closing(connect()) as db:
+        with db:
+            db.execute(
+                'INSERT OR REPLACE INTO checkpoints (task, "window", rows, completed) VALUES (?, ?, ?, ?)',
+                (task, window, rows or 0, datetime.datetime.now().isoformat(" ")),
+            )
+
+
+def watermark(task):
+    # The newest source timestamp task has loaded, or None.
+    with closing(connect()) as db:
+        row = db.execute(
+            "SELECT mark FROM watermarks WHERE task = ?", (task,)
+        ).fetchone()
+    return datetime.datetime.fromisoformat(row[0]) if row else None
+
+
+def set_watermark(task, mark):
+    with closing(connect()) as db:
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO watermarks (task, mark, updated) VALUES (?, ?, ?)",
+                (task, mark.isoformat(" "), datetime.datetime.now().isoformat(" ")),
+            )
+
+
+def forced(task, force):
+    # force holds task names or globs; "*" redoes everything.
+    return any(fnmatch.fnmatch(task, pattern) for pattern in force)
@@ -0,0 +1,114 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from xml.sax.saxutils import escape
+from . import cache
+from .decoder import records, chunk_size
+from .settings import settings_data
+
+requests.packages.urllib3.disable_warnings(
+    requests.packages.urllib3.exceptions.InsecureRequestWarning
+)
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+api_url = settings_data["spillman"]["url"]
+api_usr = settings_data["spillman"]["user"]
+api_pwd = settings_data["spillman"]["password"]
+
+pool_size = settings_data["spillman"].get("pool_size", 10)
+keepalive = settings_data["spillman"].get("keepalive", True)
+timeout = (
+    settings_data["spillman"].get("connect_timeout", 10),
+    settings_data["spillman"].get("read_timeout", 300),
+)
+
+headers = {"Content-Type": "application/xml"}
+if not keepalive:
+    headers["Connection"] = "close"
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    # One Session per process, shared by every extractor and thread. The
+    # adapter blocks when all pooled connections are busy instead of opening
+    # throwaway ones, so TLS handshakes are paid once per pooled connection.
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=pool_size, pool_block=True
+                )
+                new_session = requests.Session()
+                new_session.auth = (api_usr, api_pwd)
+                new_session.verify = False
+                new_session.mount("https://", adapter)
+                new_session.mount("http://", adapter)
+                _session = new_session
+    return _session
+
+
+def envelope(table, filters=None):
+    query_fields = "".join(
+        f'<{field} search_type="{search_type}">{escape(str(value))}</{field}>'
+        for field, search_type, value in filters or []
+    )
+    return (
+        '<PublicSafetyEnvelope version="1.0"><PublicSafety id=""><Query>'
+        f"<{table}>{query_fields}</{table}>"
+        "</Query></PublicSafety></PublicSafetyEnvelope>"
+    )
+
+
+def between(field, start, end):
+    return [(field, "greater_than", start), (field, "less_than", end)]
+
+
+def query(table, filters=None):
+    request = envelope(table, filters)
+
+    if cache.replay:
+        chunks = cache.read(table, request)
+        if chunks is None:
+            logging.warning(f"No cached response for {table} {filters or ''}")
+            return
+        yield from records(chunks, table)
+        return
+
+    response = session().post(
+        api_url,
+        data=request,
+        headers=headers,
+        timeout=timeout,
+        stream=True,
+    )
+    try:
+        response.raise_for_status()
+        chunks = response.iter_content(chunk_size=chunk_size)
+        if cache.cache_enabled:
+            chunks = cache.tee(table, request, filters, chunks)
+        yield from records(chunks, table)
+    finally:
+        response.close()
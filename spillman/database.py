@@ -14,17 +14,31 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import time
+import queue
+import logging
+import threading
 import pymysql
-from sqlalchemy import create_engine
+from contextlib import contextmanager
 from .settings import settings_data
 
+warehouse_settings = settings_data["databases"]["warehouse"]
+pool_size = warehouse_settings.get("pool_size", 8)
+read_pool_size = warehouse_settings.get("read_pool_size", 4)
+pool_timeout = warehouse_settings.get("pool_timeout", 600)
+pool_ping_seconds = warehouse_settings.get("ping_seconds", 30)
 
-def connect():
+session_setup = "SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED"
+
+
+def connect(local_infile=False):
     return pymysql.connect(
         host=settings_data["databases"]["warehouse"]["host"],
         user=settings_data["databases"]["warehouse"]["user"],
         password=settings_data["databases"]["warehouse"]["password"],
         database=settings_data["databases"]["warehouse"]["schema"],
+        init_command=session_setup,
+        local_infile=local_infile,
     )
 
 
@@ -34,17 +48,76 @@ def connect_read():
         user=settings_data["databases"]["warehouse"]["user"],
         password=settings_data["databases"]["warehouse"]["password"],
         database=settings_data["databases"]["warehouse"]["schema"],
+        init_command=session_setup,
     )
 
 
-db = connect()
-cursor = db.cursor()
-cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
-cursor.close()
-db.close()
+class ConnectionPool:
+    # At most size open connections to one host, shared between threads.
+    # Connections are opened on demand, reused most-recently-returned first,
+    # pinged before reuse once they have sat idle for ping_seconds, and
+    # reopened when the server has dropped them.
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        if not self.slots.acquire(timeout=pool_timeout):
+            raise TimeoutError(f"No free database connection after {pool_timeout}s")
+        db = None
+        try:
+            db = self.checkout()
+            yield db
+        except Exception:
+            # Never hand the next caller an open transaction or a broken
+            # connection.
+            if db is not None:
+                try:
+                    db.rollback()
+                except pymysql.err.Error:
+                    discard(db)
+                    db = None
+            raise
+        finally:
+            if db is not None:
+                self.idle.put((db, time.monotonic()))
+            self.slots.release()
+
+    def checkout(self):
+        while True:
+            try:
+                db, returned = self.idle.get_nowait()
+            except queue.Empty:
+                return self.factory()
+
+            if time.monotonic() - returned < pool_ping_seconds:
+                return db
+            try:
+                db.ping(reconnect=True)
+                return db
+            except pymysql.err.Error as e:
+                logging.debug(f"Dropping stale database connection: {e}")
+                discard(db)
+
+
+def discard(db):
+    try:
+        db.close()
+    except pymysql.err.Error:
+        pass
+
+
+# Nothing connects at import; the first checkout opens a connection.
+warehouse_pool = ConnectionPool(connect, pool_size)
+warehouse_read_pool = ConnectionPool(connect_read, read_pool_size)
+
+
+def connection():
+    return warehouse_pool.connection()
+
 
-db_ro = connect_read()
-cursor = db_ro.cursor()
-cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
-cursor.close()
-db_ro.close()
+def read_connection():
+    return warehouse_read_pool.connection()
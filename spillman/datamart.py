@@ -15,16 +15,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import datetime
-import traceback
 import logging
-import requests
 import time
 from .settings import settings_data
-from .database import connect, connect_read
-
-requests.packages.urllib3.disable_warnings(
-    requests.packages.urllib3.exceptions.InsecureRequestWarning
-)
+from .database import connection
+from .runner import run
 
 logging.basicConfig(
     format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
@@ -32,34 +27,43 @@ logging.basicConfig(
 
 
 def runProcedure(procName):
+    # Retries up to max_retries times, then raises for the runner to report,
+    # so anything that depends on the procedure is skipped.
     max_retries = 5
-    try:
-        db = connect()
+    with connection() as db:
         retry_count = 0
-        while retry_count < max_retries:
+        while True:
             try:
-                cursor = db.cursor()
-                logging.info(f"Running Stored Procedure: {procName}")
-                cursor.callproc(f"{procName}")
+                with db.cursor() as cursor:
+                    logging.info(f"Running Stored Procedure: {procName}")
+                    cursor.callproc(f"{procName}")
                 db.commit()
                 break
             except Exception as e:
                 retry_count += 1
+                if retry_count == max_retries:
+                    raise
                 logging.info(f"Retrying ({retry_count}/{max_retries}) Error: {e}")
                 time.sleep(60)
-        if retry_count == max_retries:
-            logging.error(traceback.print_exc())
-        cursor.close()
-        db.close()
-    except Exception as e:
-        cursor.close()
-        db.close()
-        logging.error(traceback.print_exc())
+                db.ping(reconnect=True)
+
+
+# The daily procedures only read incident and radiolog data, so they can
+# start as soon as those extracts are loaded.
+daily_procedures = [
+    "spillman_dm.CREATE_DM_INC_RLOG_3Y",
+    "spillman_dm.CREATE_DM_INC_RLOG_1Y",
+    "spillman_dm.CREATE_DM_INC_RLOG_6M",
+    "spillman_dm.CREATE_DM_INC_RLOG_3M",
+    "spillman_dm.CREATE_DM_INC_RLOG_1M",
+]
+daily_inputs = ["lawincident", "fireincident", "emsincident", "rlog"]
 
 
 def daily():
-    runProcedure("spillman_dm.CREATE_DM_INC_RLOG_3Y")
-    runProcedure("spillman_dm.CREATE_DM_INC_RLOG_1Y")
-    runProcedure("spillman_dm.CREATE_DM_INC_RLOG_6M")
-    runProcedure("spillman_dm.CREATE_DM_INC_RLOG_3M")
-    runProcedure("spillman_dm.CREATE_DM_INC_RLOG_1M")
+    # One at a time and in order; a procedure that fails does not stop the
+    # ones after it.
+    return run(
+        [(procedure, runProcedure, (procedure,)) for procedure in daily_procedures],
+        workers=1,
+    )
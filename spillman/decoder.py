@@ -0,0 +1,63 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import xml.etree.ElementTree as ET
+
+chunk_size = 64 * 1024
+
+record_path = ("PublicSafetyEnvelope", "PublicSafety", "Response")
+
+
+def records(chunks, table):
+    # Incrementally decode a PublicSafetyEnvelope response. Each record element
+    # under Response/<table> is turned into a flat dict as soon as it closes,
+    # then dropped from the tree so memory stays flat regardless of row count.
+    parser = ET.XMLPullParser(events=("start", "end"))
+    path = []
+    parent = [None]
+
+    for chunk in chunks:
+        if chunk:
+            parser.feed(chunk)
+            yield from _drain(parser, path, parent, table)
+
+    parser.close()
+    yield from _drain(parser, path, parent, table)
+
+
+def _drain(parser, path, parent, table):
+    for event, elem in parser.read_events():
+        if event == "start":
+            path.append(elem.tag)
+            if tuple(path) == record_path:
+                parent[0] = elem
+            continue
+
+        if len(path) == 4 and elem.tag == table and tuple(path[:3]) == record_path:
+            yield _flatten(elem)
+            parent[0].remove(elem)
+
+        path.pop()
+
+
+def _flatten(elem):
+    row = {}
+    for child in elem:
+        text = child.text
+        if text is not None:
+            text = text.strip()
+        row[child.tag] = text if text else None
+    return row
@@ -0,0 +1,137 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import datetime
+from . import cache, spool, keyindex, checkpoint
+from .client import query, between
+from .loadtable import BatchWriter
+from .mapping import mappings
+from .settings import settings_data
+from .windows import query_windows
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+
+def extract_tasks(tables, dates, force=()):
+    # Runner tasks for every table and day without a checkpoint, plus the
+    # tables in force, which are extracted again either way.
+    windows = [date.strftime("%Y-%m-%d") for date in dates]
+    done = checkpoint.completed(windows)
+    tasks = []
+    for window in windows:
+        for table in tables:
+            if (table, window) in done and not checkpoint.forced(table, force):
+                continue
+            tasks.append((f"{table} {window}", checkpointed, (table, window)))
+
+    skipped = len(windows) * len(tables) - len(tasks)
+    if skipped:
+        logging.info(f"Skipping {skipped} extracts already completed")
+    return tasks
+
+
+def checkpointed(name, date):
+    # With the spool on, the checkpoint means the rows are safely spooled;
+    # a drain loads them. A replay that misses the cache loads nothing, so
+    # replayed days are never recorded as complete.
+    rows = extract(name, date)
+    if not cache.replay:
+        checkpoint.mark_complete(name, date, rows)
+    return rows
+
+
+def extract(name, date):
+    # Pull one day of a mapped Spillman table and load it into the warehouse.
+    mapping = mappings[name]
+    start_date = datetime.datetime.strptime(date, "%Y-%m-%d")
+    end_date = start_date + datetime.timedelta(days=1)
+
+    logging.info(f"Processing {mapping.label} from {start_date} to {end_date}")
+    return load(mapping, fetch(mapping, start_date, end_date))
+
+
+def load(mapping, records, observe=None):
+    # Transform Spillman records with mapping and load them, returning the
+    # rows loaded or spooled. observe, if given, is called with every batch
+    # before rows already loaded are dropped.
+
+    # Rows whose key is already loaded are dropped here; re-runs over loaded
+    # dates only cost the Spillman pull.
+    keys = keyindex.for_table(mapping.target) if mapping.key else None
+
+    if spool.spool_enabled:
+        # Loader workers pick the rows up from the spool and record their
+        # keys; until then they are pending in the key index.
+        with spool.SpoolWriter() as writer:
+            for rows in mapping.batches(records):
+                if observe:
+                    observe(rows)
+                if keys:
+                    rows = keys.filter(rows)
+                writer.append(mapping.target, mapping.columns, rows, mapping.duplicates)
+                if keys:
+                    keys.spooled(rows)
+        logging.info(f"Spooled {writer.rows} {mapping.label}{dropped(keys)}")
+        return writer.rows
+
+    with BatchWriter() as writer:
+        for rows in mapping.batches(records):
+            if observe:
+                observe(rows)
+            if keys:
+                rows = keys.filter(rows)
+            writer.add(mapping.target, mapping.columns, rows, mapping.duplicates)
+            if keys:
+                keys.stage(rows)
+
+    # Only once the writer has committed do the keys count as loaded.
+    if keys:
+        keys.commit(writer.rejected)
+
+    counts = writer.counts
+    logging.info(
+        f"Processed {mapping.label}: {counts['inserted']} inserted, {counts['updated']} updated, {counts['skipped']} skipped{dropped(keys)}"
+    )
+    return writer.loaded
+
+
+def dropped(keys):
+    return f", {keys.dropped} already loaded" if keys else ""
+
+
+def fetch(mapping, start_date, end_date):
+    if mapping.window == "time":
+        return query_windows(
+            mapping.source,
+            mapping.query_field,
+            start_date,
+            end_date,
+            mapping.query_format,
+        )
+
+    # Date-only fields: greater_than is exclusive, so start from the day before.
+    start = start_date - datetime.timedelta(seconds=1)
+    return query(
+        mapping.source,
+        between(
+            mapping.query_field,
+            start.strftime(mapping.query_format),
+            end_date.strftime(mapping.query_format),
+        ),
+    )
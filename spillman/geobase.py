@@ -16,148 +16,164 @@
 # limitations under the License.
 import sys
 import urllib.request as urlreq
-import json
 import logging
-import requests
-import xmltodict
-import traceback
 import datetime
+import threading
+from decimal import Decimal
+from contextlib import closing
 from .loadtable import *
+from .client import query, between
+from .mapping import mappings
+from .runner import run
+from .state import load_state, save_state
 from .settings import settings_data
-from .database import db
-
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+from .database import read_connection
 
 logging.basicConfig(
     format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
 )
 
-api_url = settings_data["spillman"]["url"]
-api_usr = settings_data["spillman"]["user"]
-api_pwd = settings_data["spillman"]["password"]
+geobase_settings = settings_data.get("geobase") or {}
+geobase_page_size = geobase_settings.get("page_size", 10000)
+geobase_workers = geobase_settings.get("workers", 4)
+geobase_resume = datetime.timedelta(hours=geobase_settings.get("resume_hours", 72))
+
+geobase_table = mappings["geobase"].source
+geobase_id_field = mappings["geobase"].query_field
+geobase_progress = "geobase.json"
+geobase_progress_lock = threading.Lock()
+
+
+def extract(workers=None):
+    top = find_id_span()
+    if top is None:
+        logging.info("No Geobase addresses found")
+        return []
+
+    # Progress only carries over to a rerun soon after a failed import; a
+    # later refresh starts over rather than skip pages loaded long ago.
+    progress = load_state(geobase_progress) or {}
+    if progress.get("page_size") != geobase_page_size or stale(progress):
+        progress = {
+            "page_size": geobase_page_size,
+            "started": datetime.datetime.now().isoformat(),
+            "done": [],
+        }
+    done = set(progress["done"])
+    if done:
+        logging.info(f"Resuming Geobase import, {len(done)} pages already loaded")
+
+    tasks = [
+        (f"geobase {start}-{start + geobase_page_size}", load_page, (start, progress))
+        for start in range(0, top, geobase_page_size)
+        if start not in done
+    ]
+    logging.info(
+        f"Processing Geobase Address ID's 0 to {top} in {len(tasks)} pages of {geobase_page_size}"
+    )
+
+    results = run(tasks, workers or geobase_workers)
+    if all(result["status"] == "ok" for result in results):
+        save_state(geobase_progress, {})
+
+    return results
+
+
+def load_page(start, progress):
+    process(start - 1, start + geobase_page_size)
+    with geobase_progress_lock:
+        progress["done"].append(start)
+        save_state(geobase_progress, progress)
+
+
+def stale(progress):
+    try:
+        started = datetime.datetime.fromisoformat(progress["started"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return datetime.datetime.now() - started > geobase_resume
+
 
-session = requests.Session()
-session.auth = (api_usr, api_pwd)
+def find_id_span():
+    # Find an exclusive upper bound for address IDs using probes that only read
+    # the first matching record: double the bound until a range comes back
+    # empty, then bisect down to page granularity. Each probe asks for every
+    # ID above a bound, so a gap in the IDs never ends the search early.
+    if not ids_above(0):
+        return None
 
+    bound = geobase_page_size
+    while ids_above(bound):
+        bound *= 2
 
-def extract():
-    # process("0", "1000")
-    process("0", "50000")
-    process("49999", "100000")
-    process("99999", "150000")
-    process("149999", "200000")
-    process("199999", "250000")
-    process("249999", "300000")
+    low = bound // 2 if bound > geobase_page_size else 0
+    while bound - low > geobase_page_size:
+        mid = (low + bound) // 2
+        if ids_above(mid):
+            low = mid
+        else:
+            bound = mid
+
+    logging.debug(f"Geobase address IDs end below {bound}")
+    return bound
+
+
+def ids_above(start_id):
+    # The stream is closed after its first record.
+    filters = [(geobase_id_field, "greater_than", start_id - 1)]
+    with closing(query(geobase_table, filters)) as records:
+        return next(records, None) is not None
 
 
 def process(start_id, end_id):
     logging.info(f"Processing Geobase Address ID's from {start_id} to {end_id}")
 
-    try:
-        headers = {"Content-Type": "application/xml"}
-
-        try:
-            request_geobase = f"""
-                <PublicSafetyEnvelope version="1.0">
-                    <PublicSafety id="">
-                        <Query>
-                            <GeobaseAddressIDMaintenance>
-                                <IDNumberOfAddress search_type="greater_than">{start_id}</IDNumberOfAddress>
-                                <IDNumberOfAddress search_type="less_than">{end_id}</IDNumberOfAddress>
-                            </GeobaseAddressIDMaintenance>
-                        </Query>
-                    </PublicSafety>
-                </PublicSafetyEnvelope>
-                 """
-
-            geobase_xml = session.post(
-                api_url, data=request_geobase, headers=headers, verify=False
-            )
-            geobase_decoded = geobase_xml.content.decode("utf-8")
-            geobase = json.loads(json.dumps(xmltodict.parse(geobase_decoded)))
-            geobase = geobase["PublicSafetyEnvelope"]["PublicSafety"]["Response"][
-                "GeobaseAddressIDMaintenance"
-            ]
-
-        except Exception as e:
-            error = format(str(e))
-            if error.find("'NoneType'") != -1:
-                logging.debug(f"Zero results from table.")
-                return
-            else:
-                logging.error(traceback.print_exc())
-                return
-
-        for results in geobase:
-            try:
-                geobase_id = results["IDNumberOfAddress"]
-            except KeyError:
-                continue
-            except TypeError:
-                continue
-
-            try:
-                house_number = results["HouseNumber"]
-            except KeyError:
-                house_number = ""
-
-            try:
-                street_address = results["StreetAddress"]
-                street_address = street_address.replace('"', "")
-                street_address = street_address.replace("'", "")
-                street_address = street_address.replace(";", "")
-            except KeyError:
-                street_address = ""
-
-            try:
-                city_cd = results["CityCode"]
-            except KeyError:
-                city_cd = ""
-
-            try:
-                zipcode = results["ZIP"]
-            except KeyError:
-                zipcode = ""
-
-            try:
-                zone_law = results["ZoneLa"]
-            except KeyError:
-                zone_law = ""
-
-            try:
-                zone_fire = results["ZoneFa"]
-            except KeyError:
-                zone_fire = ""
-
-            try:
-                zone_ems = results["ZoneEa"]
-            except KeyError:
-                zone_ems = ""
-
-            try:
-                latitude = float(results["YCoordinate"]) / 1e6
-            except KeyError:
-                latitude = 0
-
-            try:
-                longitude = float(results["XCoordinate"]) / 1e6
-            except KeyError:
-                longitude = 0
-
-            load_geobase(
-                geobase_id,
-                house_number,
-                street_address,
-                city_cd,
-                zipcode,
-                zone_law,
-                zone_fire,
-                zone_ems,
-                latitude,
-                longitude,
+    mapping = mappings["geobase"]
+    existing = existing_rows(start_id, end_id)
+    geobase = query(geobase_table, between(geobase_id_field, start_id, end_id))
+
+    # Only new and changed addresses are written; a refresh where little
+    # has changed costs one read per page and a handful of upserts.
+    pulled = 0
+    with BatchWriter() as writer:
+        for rows in mapping.batches(geobase):
+            pulled += len(rows)
+            changed = [row for row in rows if row_changed(row, existing)]
+            writer.add(mapping.target, mapping.columns, changed, mapping.duplicates)
+
+    logging.info(
+        f"Geobase Address ID's {start_id} to {end_id}: {pulled} pulled, {writer.counts['inserted']} new, {writer.counts['updated']} changed"
+    )
+    return writer.counts
+
+
+def existing_rows(start_id, end_id):
+    # Warehouse copy of the addresses in (start_id, end_id), keyed by ID. The
+    # ID is the first mapped column.
+    mapping = mappings["geobase"]
+    columns = ", ".join(f"`{column}`" for column in mapping.columns)
+    with read_connection() as db_ro:
+        with db_ro.cursor() as cursor:
+            cursor.execute(
+                f"SELECT {columns} FROM {mapping.target} WHERE `{mapping.columns[0]}` > %s AND `{mapping.columns[0]}` < %s",
+                (start_id, end_id),
             )
+            return dict((str(row[0]), row) for row in cursor.fetchall())
+
 
-    except Exception as e:
-        logging.error(traceback.print_exc())
+def row_changed(row, existing):
+    current = existing.get(str(row[0]))
+    if current is None:
+        return True
+    return not all(same_value(new, old) for new, old in zip(row, current))
+
+
+def same_value(new, old):
+    # Spillman values arrive as strings and floats; the warehouse may hand
+    # back ints, decimals or NULLs for the same data.
+    if isinstance(old, (int, float, Decimal)):
+        try:
+            return abs(float(new) - float(old)) < 1e-6
+        except (TypeError, ValueError):
+            return False
+    return ("" if new is None else str(new)) == ("" if old is None else str(old))
@@ -0,0 +1,232 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import time
+import glob
+import fcntl
+import hashlib
+import logging
+import datetime
+import threading
+from array import array
+from bisect import bisect_left
+from pymysql.cursors import SSCursor
+from . import timestamps
+from .mapping import mappings
+from .settings import settings_data
+from .database import read_connection
+from .state import state_dir
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+keyindex_settings = settings_data.get("keyindex") or {}
+keyfilter_enabled = keyindex_settings.get("enabled", True)
+keyindex_dir = keyindex_settings.get("dir", os.path.join(state_dir, "keys"))
+keyindex_keep_days = keyindex_settings.get("keep_days", 90)
+
+# One file per fact table and day of its key_date column, holding the sorted
+# 64-bit hashes of the keys already in the warehouse. A day is seeded from
+# the read replica the first time it is needed and only ever grows after
+# that, as loads commit.
+_pruned = False
+
+# Keys of rows this process has spooled but not yet loaded, as (day, hash)
+# pairs by table.
+# They are dropped like loaded keys, so a stream poll whose overlap repeats
+# them does not spool them again while the loaders are behind.
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def set_keyfilter(enabled):
+    # None keeps the keyindex.enabled setting.
+    global keyfilter_enabled
+    if enabled is not None:
+        keyfilter_enabled = enabled
+
+
+def key_hash(values):
+    # Warehouse rows hand back ints and datetimes where extracted rows may
+    # have strings, so keys are hashed by their text.
+    text = "\x1f".join("" if value is None else str(value) for value in values)
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def contains(hashes, value):
+    i = bisect_left(hashes, value)
+    return i < len(hashes) and hashes[i] == value
+
+
+def read_hashes(path):
+    hashes = array("Q")
+    try:
+        with open(path, "rb") as f:
+            hashes.frombytes(f.read())
+    except FileNotFoundError:
+        return None
+    return hashes
+
+
+def merge_hashes(path, added):
+    # Merge under an exclusive lock with whatever is on disk now, so
+    # concurrent runs over the same day never drop each other's keys.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        current = read_hashes(path) or array("Q")
+        merged = array("Q", sorted(set(current).union(added)))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            merged.tofile(f)
+        os.replace(tmp, path)
+    return merged
+
+
+def for_table(table):
+    # The index for a warehouse table, or None if the filter is off or no
+    # mapping into that table declares a key. Tables loaded with duplicates:
+    # update want every row, so they are never filtered.
+    if not keyfilter_enabled:
+        return None
+    for mapping in mappings.values():
+        if mapping.target == table and mapping.key and mapping.duplicates == "skip":
+            return KeyIndex(mapping)
+    return None
+
+
+class KeyIndex:
+    # Drops rows whose key is already loaded. Keys of rows handed to the
+    # loader are staged, and only recorded by commit once the loader has
+    # committed them.
+
+    def __init__(self, mapping):
+        self.table = mapping.target
+        self.key = mapping.key
+        self.key_date = mapping.key_date
+        self.key_positions = [mapping.columns.index(column) for column in self.key]
+        self.date_position = mapping.columns.index(mapping.key_date)
+        self.known = {}
+        self.unseeded = set()
+        self.staged = []
+        self.dropped = 0
+
+    def day(self, row):
+        value = row[self.date_position]
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        return timestamps.missing_date
+
+    def row_hash(self, row):
+        return key_hash([row[i] for i in self.key_positions])
+
+    def path(self, day):
+        return os.path.join(keyindex_dir, self.table, f"{day.isoformat()}.idx")
+
+    def known_hashes(self, day):
+        hashes = self.known.get(day)
+        if hashes is None:
+            hashes = read_hashes(self.path(day))
+            if hashes is None:
+                hashes = self.seed(day)
+            self.known[day] = hashes
+        return hashes
+
+    def seed(self, day):
+        # An unreachable replica only costs the filter for this day. No file
+        # is written for it, so the next run seeds it again.
+        columns = ", ".join(f"`{column}`" for column in self.key)
+        start = datetime.datetime.combine(day, datetime.time())
+        try:
+            with read_connection() as db_ro:
+                with db_ro.cursor(SSCursor) as cursor:
+                    cursor.execute(
+                        f"SELECT {columns} FROM {self.table} WHERE `{self.key_date}` >= %s AND `{self.key_date}` < %s",
+                        (start, start + datetime.timedelta(days=1)),
+                    )
+                    hashes = set(key_hash(row) for row in cursor)
+        except Exception as e:
+            logging.warning(f"Could not seed {self.table} keys for {day}: {e}")
+            self.unseeded.add(day)
+            return array("Q")
+
+        logging.debug(f"Seeded {len(hashes)} {self.table} keys for {day}")
+        return merge_hashes(self.path(day), hashes)
+
+    def filter(self, rows):
+        kept = []
+        for row in rows:
+            day, value = self.day(row), self.row_hash(row)
+            if not contains(self.known_hashes(day), value):
+                kept.append((row, (day, value)))
+        with _pending_lock:
+            pending = _pending.get(self.table, ())
+            kept = [row for row, key in kept if key not in pending]
+        self.dropped += len(rows) - len(kept)
+        return kept
+
+    def stage(self, rows):
+        self.staged.extend((self.day(row), self.row_hash(row)) for row in rows)
+
+    def spooled(self, rows):
+        # The rows are on their way to the warehouse through the spool; the
+        # loader's commit records them as loaded.
+        with _pending_lock:
+            _pending.setdefault(self.table, set()).update(
+                (self.day(row), self.row_hash(row)) for row in rows
+            )
+
+    def commit(self, rejected=()):
+        # Rows the warehouse rejected stay out of the index so a re-run
+        # tries them again.
+        rejected = set((self.day(row), self.row_hash(row)) for row in rejected)
+        added = {}
+        for day, value in self.staged:
+            if (day, value) not in rejected:
+                added.setdefault(day, set()).add(value)
+        for day, values in added.items():
+            if day in self.unseeded:
+                # A file holding only these keys would never be seeded.
+                merged = set(self.known.get(day, ())).union(values)
+                self.known[day] = array("Q", sorted(merged))
+            else:
+                self.known[day] = merge_hashes(self.path(day), values)
+        # Loaded keys are now recorded, and rejected ones may be tried again.
+        with _pending_lock:
+            _pending.get(self.table, set()).difference_update(self.staged)
+        self.staged = []
+        prune()
+
+
+def prune():
+    # Days not touched in keyindex.keep_days are removed once per process;
+    # a later run over them seeds them again.
+    global _pruned
+    if _pruned or not keyindex_keep_days:
+        return
+    _pruned = True
+    cutoff = time.time() - keyindex_keep_days * 86400
+    for path in glob.glob(os.path.join(keyindex_dir, "*", "*.idx")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -14,12 +14,18 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+import re
+import sys
 import datetime
+import tempfile
 import traceback
 import logging
+import pymysql
 import requests
+from contextlib import ExitStack
 from .settings import settings_data
-from .database import connect, connect_read
+from .database import connect, connection
 
 requests.packages.urllib3.disable_warnings(
     requests.packages.urllib3.exceptions.InsecureRequestWarning
@@ -29,19 +35,22 @@ logging.basicConfig(
     format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
 )
 
+loader_settings = settings_data.get("loader") or {}
+loader_batch_rows = loader_settings.get("batch_rows", 5000)
+loader_max_statement = loader_settings.get("max_statement_bytes")
+loader_bulk_rows = loader_settings.get("bulk_rows", 100000)
+loader_tmp_dir = loader_settings.get("tmp_dir")
+bulk_tables = set(
+    loader_settings.get("bulk_tables", ["avl", "radiolog", "cad", "incident"])
+)
+bulk = loader_settings.get("bulk", False)
 
-def execute_sql(sql, values):
-    try:
-        db = connect()
-        cursor = db.cursor()
-        cursor.execute(sql, values)
-        db.commit()
-        cursor.close()
-        db.close()
-    except Exception as e:
-        cursor.close()
-        db.close()
-        handle_db_error(e, sql)
+
+def set_bulk(enabled):
+    # None keeps the loader.bulk setting.
+    global bulk
+    if enabled is not None:
+        bulk = enabled
 
 
 def handle_db_error(exception, sql):
@@ -49,486 +58,252 @@ def handle_db_error(exception, sql):
     if "Duplicate entry" in error:
         logging.debug("Entry already exists in database")
     else:
-        logging.error(traceback.print_exc())
+        logging.error(traceback.format_exc())
         logging.error(sql)
 
 
-def load_incident(
-    callid,
-    incident_id,
-    nature,
-    address,
-    city,
-    state,
-    zip,
-    location,
-    agency,
-    responsible_officer,
-    geo_addr,
-    name_id,
-    received_by,
-    occurred_dt1,
-    occurred_dt2,
-    reported_dt,
-    dispatch_dt,
-    contact,
-    condition,
-    disposition,
-    type,
-):
-    try:
-        sql = """
-        INSERT INTO incident(
-            callid, incident_id, nature, address, city, state, zip, location, agency,
-            responsible_officer, geo_addr, name_id, received_by, occurred_dt1, occurred_dt2,
-            reported_dt, dispatch_dt, contact, `condition`, disposition, type
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        values = (
-            callid,
-            incident_id,
-            nature,
-            address,
-            city,
-            state,
-            zip,
-            location,
-            agency,
-            responsible_officer,
-            geo_addr,
-            name_id,
-            received_by,
-            occurred_dt1,
-            occurred_dt2,
-            reported_dt,
-            dispatch_dt,
-            contact,
-            condition,
-            disposition,
-            type,
+def insert_parts(table, columns, duplicates="skip"):
+    # Statement prefix, one row's placeholders and suffix of a multi-row
+    # INSERT. "skip" leaves rows with an existing key alone, "update"
+    # overwrites them with the new values.
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    row = f"({', '.join(['%s'] * len(columns))})"
+    if duplicates == "update":
+        updates = ", ".join(f"`{column}` = VALUES(`{column}`)" for column in columns)
+        return (
+            f"INSERT INTO {table} ({column_list}) VALUES ",
+            row,
+            f" ON DUPLICATE KEY UPDATE {updates}",
         )
-        logging.debug(f"Processing incident: {callid}")
-        execute_sql(sql, values)
+    return f"INSERT IGNORE INTO {table} ({column_list}) VALUES ", row, ""
+
+
+def info_duplicates(cursor):
+    # Multi-row INSERTs report "Records: 3  Duplicates: 1  Warnings: 0";
+    # pymysql keeps that string on the last result.
+    message = getattr(getattr(cursor, "_result", None), "message", None) or b""
+    if isinstance(message, bytes):
+        message = message.decode("utf-8", "replace")
+    match = re.search(r"Duplicates: (\d+)", message)
+    return int(match.group(1)) if match else None
+
+
+def statement_counts(duplicates, rows, affected, found):
+    # Rows inserted, updated and skipped by one INSERT of rows rows. Affected
+    # rows count 1 per insert and 2 per update; found is the number of rows
+    # that hit an existing key.
+    if duplicates != "update":
+        return affected, 0, rows - affected
+    if found is None:
+        # Single-row statements carry no info string.
+        found = 0 if affected == 1 else rows
+    inserted = rows - found
+    updated = (affected - inserted) // 2
+    return inserted, updated, found - updated
+
+
+def load_data_sql(table, columns):
+    return f"""
+    LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {table}
+    CHARACTER SET utf8mb4
+    FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+    LINES TERMINATED BY '\\n'
+    ({', '.join(f'`{column}`' for column in columns)});
+    """
+
+
+tsv_escapes = str.maketrans(
+    {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"}
+)
 
-    except Exception as e:
-        logging.error(traceback.print_exc())
 
+def tsv_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, str):
+        return value.translate(tsv_escapes)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return str(value)
 
-def load_sylog(userid, mode, table, data, logdate):
-    try:
-        sql = """
-        INSERT INTO sylog (user_id, table, mode, date, data)
-        VALUES (%s, %s, %s, %s, %s);
-        """
-        values = (userid, table, mode, logdate, data)
-        logging.debug(f"Processing system log for user: {user_id} and date: {date}")
-        execute_sql(sql, values)
 
-    except Exception as e:
-        logging.error(traceback.print_exc())
+def write_tsv(f, rows):
+    for row in rows:
+        f.write("\t".join(map(tsv_value, row)))
+        f.write("\n")
 
 
-def load_avl(callid, agency, unit, unit_status, gps_x, gps_y, heading, speed, logdate):
+def statement_limit(cursor):
+    # Multi-row INSERTs have to stay under the server's max_allowed_packet.
     try:
-        sql = """
-        INSERT INTO avl (callid, agency, unit, unit_status, gps_x, gps_y, heading, speed, logdate)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        values = (
-            callid,
-            agency,
-            unit,
-            unit_status,
-            gps_x,
-            gps_y,
-            heading,
-            speed,
-            logdate,
+        cursor.execute("SELECT @@max_allowed_packet")
+        limit = cursor.fetchone()[0] - 1024
+    except pymysql.err.MySQLError:
+        limit = cursor.max_stmt_length
+    if loader_max_statement:
+        limit = min(limit, loader_max_statement)
+    return limit
+
+
+class BatchWriter:
+    # Buffers rows per target table on one warehouse connection and writes
+    # them with multi-row INSERT IGNORE or INSERT ... ON DUPLICATE KEY UPDATE
+    # statements, committing once per flush. Counts of inserted, updated and
+    # skipped rows are logged per batch and kept in counts. Tables in
+    # loader.bulk_tables are written with LOAD DATA LOCAL INFILE instead when
+    # bulk mode is on.
+
+    def __init__(self):
+        self.buffers = {}
+        self.counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        self.rejected = []
+        self.bulk = bulk
+        self.connections = ExitStack()
+        if self.bulk:
+            # LOCAL INFILE has to be allowed when the connection is opened, so
+            # bulk loads use their own connection instead of the pool.
+            self.db = connect(local_infile=True)
+            self.connections.callback(self.db.close)
+        else:
+            self.db = self.connections.enter_context(connection())
+        self.cursor = self.db.cursor()
+        self.connections.callback(self.cursor.close)
+        self.max_statement = statement_limit(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # The pool has to see a failure, the caller's or the final flush's,
+        # to roll the connection back instead of returning it mid-transaction.
+        if exc_type is None:
+            try:
+                self.flush()
+            except BaseException:
+                self.connections.__exit__(*sys.exc_info())
+                raise
+        return self.connections.__exit__(exc_type, exc, tb)
+
+    @property
+    def loaded(self):
+        return self.counts["inserted"] + self.counts["updated"]
+
+    def add(self, table, columns, rows, duplicates="skip"):
+        key = (table, tuple(columns), duplicates)
+        buffer = self.buffers.setdefault(key, [])
+        buffer.extend(rows)
+        if len(buffer) >= self.flush_rows(key):
+            self.flush_table(key)
+
+    def bulk_table(self, key):
+        table, columns, duplicates = key
+        return self.bulk and duplicates == "skip" and table in bulk_tables
+
+    def flush_rows(self, key):
+        if self.bulk_table(key):
+            return loader_bulk_rows
+        return loader_batch_rows
+
+    def flush(self):
+        for key in list(self.buffers):
+            self.flush_table(key)
+
+    def flush_table(self, key):
+        rows = self.buffers.pop(key, None)
+        if not rows:
+            return
+
+        table, columns, duplicates = key
+        counts = None
+        if self.bulk_table(key):
+            try:
+                counts = self.load_file(table, columns, rows)
+            except pymysql.err.OperationalError as e:
+                # Usually local_infile disabled on the server.
+                logging.warning(f"Bulk load into {table} failed, using INSERTs: {e}")
+                self.db.rollback()
+                self.bulk = False
+
+        if counts is None:
+            parts = insert_parts(table, columns, duplicates)
+            try:
+                counts = self.insert_rows(parts, duplicates, rows)
+                self.db.commit()
+            except (pymysql.err.IntegrityError, pymysql.err.DataError):
+                # One bad row fails its whole statement; retry the batch a row
+                # at a time so only that row is lost.
+                self.db.rollback()
+                counts = self.insert_each(parts, duplicates, rows)
+                self.db.commit()
+
+        inserted, updated, skipped = counts
+        self.counts["inserted"] += inserted
+        self.counts["updated"] += updated
+        self.counts["skipped"] += skipped
+        logging.info(
+            f"Loaded {len(rows)} rows into {table}: {inserted} inserted, {updated} updated, {skipped} skipped"
         )
-        logging.debug(f"Processing AVL log for unit: {unit} and date: {logdate}")
-        execute_sql(sql, values)
 
-    except Exception as e:
-        logging.error(traceback.print_exc())
-
-
-def load_msglog(msgid, from_user, to_user, subject, message, msgdate):
-    try:
-        sql = """
-        INSERT INTO msglog (msgid, from_user, to_user, subject, message, msgdate)
-        VALUES (%s, %s, %s, %s, %s, %s);
-        """
-        values = (msgid, from_user, to_user, subject, message, msgdate)
-        logging.debug(
-            f"Processing message log for user: {from_user} and date: {msgdate}"
-        )
-        execute_sql(sql, values)
-
-    except Exception as e:
-        logging.error(traceback.print_exc())
-
-
-def load_cad(
-    callid,
-    call_type,
-    nature,
-    priority,
-    reported,
-    occur_dt_1,
-    occur_dt_2,
-    address,
-    city_cd,
-    complainant_id,
-    received_type,
-    call_taker,
-    emd,
-):
-    try:
-        sql = """
-        INSERT INTO cad(
-            callid, call_type, nature, priority, reported, occur_dt_1, occur_dt_2, address,
-            city_cd, complainant_id, received_type, call_taker, emd
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        values = (
-            callid,
-            call_type,
-            nature,
-            priority,
-            reported,
-            occur_dt_1,
-            occur_dt_2,
-            address,
-            city_cd,
-            complainant_id,
-            received_type,
-            call_taker,
-            emd,
-        )
-        logging.debug(f"Processing CAD call: {callid}")
-        execute_sql(sql, values)
-
-    except Exception as e:
-        logging.error(traceback.print_exc())
-
-
-def load_rlog(
-    callid,
-    rlog_key,
-    dispatcher,
-    logdate,
-    gps_x,
-    gps_y,
-    unit,
-    zone,
-    agency,
-    tencode,
-    description,
-    sequence,
-    calltype,
-):
-    try:
-        sql = """
-        INSERT INTO radiolog(
-            rlog_key, callid, dispatcher, logdate, gps_x, gps_y, unit, zone, agency,
-            tencode, description, sequence, calltype
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        values = (
-            rlog_key,
-            callid,
-            dispatcher,
-            logdate,
-            gps_x,
-            gps_y,
-            unit,
-            zone,
-            agency,
-            tencode,
-            description,
-            sequence,
-            calltype,
-        )
-        logging.debug(f"Processing radio log: {rlog_key}")
-        execute_sql(sql, values)
-
-    except Exception as e:
-        logging.error(traceback.print_exc())
-
-
-def load_citation(
-    citation_id,
-    name_id,
-    citation_dt,
-    court_dt,
-    agency,
-    violation_dt,
-    bond_amt,
-    actual_amt,
-    posted_amt,
-    safe_amt,
-    issuing_officer,
-    court_cd,
-    zone,
-    address,
-    city,
-    state,
-    zipcode,
-    vehicle_id,
-    citation_type_cd,
-    geo_addr,
-    incident_id,
-):
-    try:
-        sql = """
-        INSERT INTO citation(
-            citation_id, name_id, citation_dt, court_dt, agency, violation_dt, bond_amt,
-            actual_amt, posted_amt, safe_amt, issuing_officer, court_cd, zone, address, city,
-            state, zip, vehicle_id, citation_type_cd, geo_addr, incident_id
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        values = (
-            citation_id,
-            name_id,
-            citation_dt,
-            court_dt,
-            agency,
-            violation_dt,
-            bond_amt,
-            actual_amt,
-            posted_amt,
-            safe_amt,
-            issuing_officer,
-            court_cd,
-            zone,
-            address,
-            city,
-            state,
-            zipcode,
-            vehicle_id,
-            citation_type_cd,
-            geo_addr,
-            incident_id,
-        )
-        logging.debug(f"Processing citation: {citation_id}")
-        execute_sql(sql, values)
-
-    except Exception as e:
-        logging.error(traceback.print_exc())
-
-
-def load_geobase(
-    geobase_id,
-    house_number,
-    street_address,
-    city_cd,
-    zipcode,
-    zone_law,
-    zone_fire,
-    zone_ems,
-    latitude,
-    longitude,
-):
-    try:
-        sql = """
-        INSERT INTO geobase (geobase_id, house_number, street_address, city_cd, zipcode, zone_law, zone_fire, zone_ems, latitude, longitude)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        """
-        values = (
-            geobase_id,
-            house_number,
-            street_address,
-            city_cd,
-            zipcode,
-            zone_law,
-            zone_fire,
-            zone_ems,
-            latitude,
-            longitude,
-        )
-        logging.debug(f"Processing geobase for ID: {geobase_id}")
-        db = connect()
-        cursor = db.cursor()
-        cursor.execute(sql, values)
-        db.commit()
-        cursor.close()
-        db.close()
-
-    except Exception as e:
-        cursor.close()
-        db.close()
-        error = format(str(e))
-        if "Duplicate entry" in error:
+    def insert_rows(self, parts, duplicates, rows):
+        prefix, row_sql, suffix = parts
+        totals = [0, 0, 0]
+        values = []
+        size = len(prefix) + len(suffix)
+
+        def execute():
+            affected = self.cursor.execute(prefix + ",".join(values) + suffix)
+            counts = statement_counts(
+                duplicates, len(values), affected, info_duplicates(self.cursor)
+            )
+            for i, count in enumerate(counts):
+                totals[i] += count
+
+        for row in rows:
+            value = self.cursor.mogrify(row_sql, row)
+            length = len(value.encode("utf-8")) + 1
+            if values and size + length > self.max_statement:
+                execute()
+                values = []
+                size = len(prefix) + len(suffix)
+            values.append(value)
+            size += length
+        if values:
+            execute()
+        return tuple(totals)
+
+    def insert_each(self, parts, duplicates, rows):
+        prefix, row_sql, suffix = parts
+        sql = prefix + row_sql + suffix
+        totals = [0, 0, 0]
+        for row in rows:
             try:
-                sql = f"SELECT geobase_id, house_number, street_address, city_cd, zipcode, zone_law, zone_fire, zone_ems, latitude, longitude from geobase where geobase_id = '{geobase_id}';"
-                db_ro = connect_read()
-                cursor = db_ro.cursor()
-                cursor.execute(sql)
-                cursor.close()
-                db_ro.close()
-                geobase_results = cursor.fetchone()
-
-                (
-                    db_geobase_id,
-                    db_house_number,
-                    db_street_address,
-                    db_city_cd,
-                    db_zipcode,
-                    db_zone_law,
-                    db_zone_fire,
-                    db_zone_ems,
-                    db_latitude,
-                    db_longitude,
-                ) = geobase_results
-
-                if house_number != db_house_number:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set house_number = '{house_number}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-                if street_address != db_street_address:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set street_address = '{street_address}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-                if city_cd != db_city_cd:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set city_cd = '{city_cd}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-                if zipcode != db_zipcode:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set zipcode = '{zipcode}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-                if zone_law != db_zone_law:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set zone_law = '{zone_law}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-                if zone_fire != db_zone_fire:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set zone_fire = '{zone_fire}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-                if zone_ems != db_zone_ems:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set zone_ems = '{zone_ems}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-                if latitude != db_latitude:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set latitude = '{latitude}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-                if longitude != db_longitude:
-                    try:
-                        db = connect()
-                        cursor = db.cursor()
-                        cursor.execute(
-                            f"update geobase set longitude = '{longitude}' where geobase_id = '{geobase_id}'"
-                        )
-                        db.commit()
-                        cursor.close()
-                        db.close()
-                    except:
-                        cursor.close()
-                        db.close()
-                        logging.error(traceback.format_exc())
-                        return
-
-            except Exception as update_error:
-                logging.error(f"Error updating geobase: {update_error}")
-                logging.error(traceback.format_exc())
-
-        else:
-            logging.error(f"Error inserting geobase: {error}")
-            logging.error(traceback.format_exc())
+                affected = self.cursor.execute(sql, row)
+                counts = statement_counts(duplicates, 1, affected, None)
+            except (pymysql.err.IntegrityError, pymysql.err.DataError) as e:
+                handle_db_error(e, sql)
+                self.rejected.append(row)
+                counts = (0, 0, 1)
+            for i, count in enumerate(counts):
+                totals[i] += count
+        return tuple(totals)
+
+    def load_file(self, table, columns, rows):
+        # IGNORE skips rows with duplicate keys, like INSERT IGNORE.
+        f = tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            suffix=".tsv",
+            prefix=f"{table}-",
+            dir=loader_tmp_dir,
+            delete=False,
+        )
+        try:
+            with f:
+                write_tsv(f, rows)
+            loaded = self.cursor.execute(load_data_sql(table, columns), f.name)
+            self.db.commit()
+            return loaded, 0, len(rows) - loaded
+        finally:
+            os.remove(f.name)
@@ -0,0 +1,232 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import re
+import yaml
+import logging
+import itertools
+import xml.etree.ElementTree as ET
+from . import timestamps
+
+mappings_file = os.path.join(os.path.dirname(__file__), "mappings.yaml")
+batch_size = 1000
+
+
+def strip_quotes(value):
+    return value.replace('"', "").replace("'", "")
+
+
+def strip_address(value):
+    return value.replace('"', "").replace("'", "").replace(";", "")
+
+
+def coordinate(value):
+    return float(value) / 1e6
+
+
+def radiolog_longitude(value):
+    return f"{value[:4]}.{value[4:]}"
+
+
+def radiolog_latitude(value):
+    return f"{value[:2]}.{value[2:]}"
+
+
+def html_text(value):
+    # Only message logs carry HTML; BeautifulSoup is slow to import.
+    from bs4 import BeautifulSoup
+
+    html = ET.fromstring(value).find(".//html")
+    if html is None or html.text is None:
+        return ""
+    return BeautifulSoup(html.text, "html.parser").get_text()
+
+
+def alphanumeric(value):
+    value = value.encode("utf-8", "ignore").decode("utf-8")
+    return re.sub(r"[^a-zA-Z0-9\s\t]", "", value).strip()
+
+
+def radiolog_key(record):
+    date = record.get("logdate") or ""
+    unit = record.get("unit") or ""
+    agency = record.get("agency") or ""
+    tencode = record.get("tencode") or ""
+    return f"{date[15:19]}{date[9:11]}{date[12:14]}{date[0:2]}{date[3:5]}{date[6:8]}{unit}{agency}{tencode}"
+
+
+converters = {
+    "strip_quotes": strip_quotes,
+    "strip_address": strip_address,
+    "coordinate": coordinate,
+    "radiolog_longitude": radiolog_longitude,
+    "radiolog_latitude": radiolog_latitude,
+    "html_text": html_text,
+    "alphanumeric": alphanumeric,
+    "radiolog_key": radiolog_key,
+}
+
+# Converters applied to a whole column of a batch at once, after the row pass
+# has collected the raw values.
+column_converters = {
+    "datetime": timestamps.datetime_column,
+    "date": timestamps.date_column,
+}
+
+converter_defaults = {
+    "datetime": timestamps.missing_datetime,
+    "date": timestamps.missing_date,
+}
+
+
+class Mapping:
+    # A table mapping from mappings.yaml: where to query it, where its rows go
+    # and how each target column is derived from a Spillman record. The field
+    # list is compiled once into a single function that converts a whole batch
+    # of records, so the per-row work is plain dict lookups and calls.
+    # Timestamp fields are then parsed a column at a time.
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.source = spec["source"]
+        self.target = spec["target"]
+        self.label = spec.get("label", name)
+        self.query_field = spec.get("query_field")
+        self.query_format = spec.get("query_format")
+        self.window = spec.get("window", "time")
+        self.duplicates = spec.get("duplicates", "skip")
+        if self.duplicates not in ("skip", "update"):
+            raise ValueError(f"{name}: duplicates must be skip or update")
+        self.fields = list(spec["fields"])
+        for column, value in (spec.get("constants") or {}).items():
+            self.fields.append({"target": column, "value": value})
+        self.columns = tuple(field["target"] for field in self.fields)
+        self.key = list(spec.get("key") or [])
+        self.key_date = spec.get("key_date")
+        self.unique_key = spec.get("unique_key", True)
+        for column in self.key + ([self.key_date] if self.key else []):
+            if column not in self.columns:
+                raise ValueError(f"{name}: key column {column} is not mapped")
+        self.column_fields = [
+            (i, column_converters[field["convert"]], _default(field))
+            for i, field in enumerate(self.fields)
+            if field.get("convert") in column_converters
+        ]
+        self.extract_rows = compile_fields(self.fields)
+
+    def batches(self, records):
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                return
+            yield self.extract(batch)
+
+    def extract_batch(self, records):
+        rows = self.extract_rows(records)
+        if not self.column_fields or not rows:
+            return rows
+
+        columns = list(zip(*rows))
+        for i, convert, default in self.column_fields:
+            columns[i] = convert(columns[i], default)
+        return list(zip(*columns))
+
+    def extract(self, records):
+        try:
+            return self.extract_batch(records)
+        except Exception:
+            # Fall back to one record at a time so a single malformed record
+            # only costs that row.
+            rows = []
+            for record in records:
+                try:
+                    rows.extend(self.extract_batch([record]))
+                except Exception as e:
+                    logging.error(f"Skipping {self.name} record {record}: {e}")
+            return rows
+
+
+def compile_fields(fields):
+    # Generate the source of a function that turns a list of records into a
+    # list of value tuples in column order, then compile it once.
+    namespace = {}
+    required = []
+    values = []
+
+    for i, field in enumerate(fields):
+        converter = field.get("convert")
+        if converter in column_converters:
+            # Left raw here and converted column-wise by Mapping.extract_batch.
+            converter = None
+            default = None
+        else:
+            default = _default(field)
+        namespace[f"c{i}"] = converters[converter] if converter else None
+        namespace[f"d{i}"] = default
+
+        if "value" in field:
+            namespace[f"d{i}"] = field["value"]
+            values.append(f"d{i}")
+            continue
+
+        source = field["source"]
+        if source == "*":
+            values.append(f"c{i}(r)")
+            continue
+
+        if isinstance(source, list):
+            lookup = " or ".join(f"get({key!r})" for key in source)
+            lookup = f"({lookup})"
+        else:
+            lookup = f"get({source!r})"
+
+        if field.get("required"):
+            required.append(f"        v{i} = {lookup}")
+            required.append(f"        if v{i} is None:")
+            required.append("            continue")
+            values.append(f"c{i}(v{i})" if converter else f"v{i}")
+        elif converter:
+            values.append(f"(d{i} if (v{i} := {lookup}) is None else c{i}(v{i}))")
+        else:
+            values.append(f"(d{i} if (v{i} := {lookup}) is None else v{i})")
+
+    lines = [
+        "def extract_batch(records):",
+        "    rows = []",
+        "    append = rows.append",
+        "    for r in records:",
+        "        get = r.get",
+        *required,
+        f"        append(({', '.join(values)},))",
+        "    return rows",
+    ]
+    exec(compile("\n".join(lines), "<mapping>", "exec"), namespace)
+    return namespace["extract_batch"]
+
+
+def _default(field):
+    return field.get("default", converter_defaults.get(field.get("convert"), ""))
+
+
+def load_mappings(path=mappings_file):
+    with open(path, "r") as f:
+        specs = yaml.safe_load(f)
+    return dict((name, Mapping(name, spec)) for name, spec in specs.items())
+
+
+mappings = load_mappings()
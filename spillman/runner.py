@@ -0,0 +1,80 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from .settings import settings_data
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+default_workers = settings_data["global"].get("workers", 1)
+
+
+def run_task(name, func, *args):
+    started = time.monotonic()
+    try:
+        func(*args)
+        status, error = "ok", ""
+    except Exception as e:
+        logging.error(f"Task {name} failed: {e}")
+        logging.error(traceback.format_exc())
+        status, error = "failed", str(e)
+
+    return {
+        "name": name,
+        "status": status,
+        "error": error,
+        "elapsed": time.monotonic() - started,
+    }
+
+
+def run(tasks, workers=None):
+    # tasks is a list of (name, func, args) tuples. Every task runs in
+    # isolation: an exception is logged and recorded, never propagated.
+    workers = workers or default_workers
+
+    if workers <= 1:
+        results = [run_task(name, func, *args) for name, func, args in tasks]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="spillman"
+        ) as executor:
+            futures = [
+                executor.submit(run_task, name, func, *args)
+                for name, func, args in tasks
+            ]
+            results = [future.result() for future in futures]
+
+    summary(results)
+    return results
+
+
+def summary(results):
+    failed = [result for result in results if result["status"] != "ok"]
+    total = sum(result["elapsed"] for result in results)
+
+    logging.info(f"Task summary: {len(results) - len(failed)} ok, {len(failed)} failed")
+    for result in results:
+        logging.info(
+            f"  {result['name']:<40} {result['status']:<7} {result['elapsed']:8.1f}s"
+        )
+    for result in failed:
+        logging.error(f"  {result['name']} failed: {result['error']}")
+    logging.info(f"Cumulative task time: {total:.1f}s")
@@ -0,0 +1,124 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .runner import run_task, summary, default_workers
+from .settings import settings_data
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+scheduler_settings = settings_data.get("scheduler") or {}
+scheduler_workers = scheduler_settings.get("workers", default_workers)
+scheduler_limits = scheduler_settings.get("limits") or {"api": 6, "datamart": 2}
+
+
+class Task:
+    # A unit of work that may start once every task named in after has
+    # finished, holding one slot of each resource in uses while it runs.
+    # Names in after that are not part of the run count as done.
+
+    def __init__(self, name, func, args=(), after=(), uses=()):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.after = tuple(after)
+        self.uses = tuple(uses)
+
+
+def schedule(tasks, workers=None, limits=None):
+    # Run tasks as their dependencies complete, at most workers at once and
+    # at most limits[resource] per resource. Ready tasks start in list
+    # order. A task whose dependency failed is not run and is recorded as
+    # skipped. Results are runner results, in list order.
+    workers = workers or scheduler_workers
+    limits = dict(scheduler_limits, **(limits or {}))
+    names = set(task.name for task in tasks)
+    for task in tasks:
+        missing = [name for name in task.after if name not in names]
+        if missing:
+            logging.debug(f"{task.name}: {', '.join(missing)} already complete")
+
+    results = {}
+    waiting = list(tasks)
+    running = {}
+    in_use = Counter()
+
+    def ready(task):
+        return all(name in results for name in task.after if name in names) and all(
+            in_use[use] < limits.get(use, workers) for use in task.uses
+        )
+
+    def blocked(task):
+        # The first dependency that did not complete, if any.
+        for name in task.after:
+            if name in results and results[name]["status"] != "ok":
+                return name
+        return None
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="spillman"
+    ) as executor:
+        while waiting or running:
+            # A skipped task can block tasks earlier in the list, so scan
+            # until nothing more is skipped.
+            scan = True
+            while scan:
+                scan = False
+                for task in list(waiting):
+                    failed = blocked(task)
+                    if failed:
+                        logging.error(
+                            f"Skipping {task.name}: {failed} did not complete"
+                        )
+                        results[task.name] = skipped(task, f"{failed} did not complete")
+                        waiting.remove(task)
+                        scan = True
+                    elif len(running) < workers and ready(task):
+                        waiting.remove(task)
+                        in_use.update(task.uses)
+                        future = executor.submit(
+                            run_task, task.name, task.func, *task.args
+                        )
+                        running[future] = task
+
+            if not running:
+                # Nothing is running and nothing could start: whatever is
+                # left waits on itself.
+                if waiting:
+                    logging.error(
+                        f"Dependency cycle between {', '.join(task.name for task in waiting)}"
+                    )
+                for task in waiting:
+                    results[task.name] = skipped(task, "dependency cycle")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                in_use.subtract(task.uses)
+                results[task.name] = future.result()
+
+    results = [results[task.name] for task in tasks]
+    summary(results)
+    return results
+
+
+def skipped(task, reason):
+    return {"name": task.name, "status": "skipped", "error": reason, "elapsed": 0}
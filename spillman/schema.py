@@ -0,0 +1,247 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+import threading
+from . import timestamps
+from .state import load_state, save_state
+
+schema_file = "schemas.json"
+schema_lock = threading.Lock()
+
+int_pattern = re.compile(r"-?(0|[1-9][0-9]{0,17})\Z")
+decimal_pattern = re.compile(r"-?(0|[1-9][0-9]*)\.([0-9]+)\Z")
+string_widths = (8, 16, 32, 64, 128, 255)
+max_key_length = 64
+
+
+def value_kind(value):
+    # Codes with leading zeros ("007") stay strings so they keep their zeros.
+    if int_pattern.match(value):
+        return "int"
+    if decimal_pattern.match(value):
+        return "decimal"
+    if len(value) == 10 and timestamps.parse_date(value) is not None:
+        return "date"
+    if len(value) == 19 and timestamps.parse_datetime(value) is not None:
+        return "datetime"
+    return "string"
+
+
+def widen(a, b):
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    if {a, b} == {"int", "decimal"}:
+        return "decimal"
+    if {a, b} == {"date", "datetime"}:
+        return "datetime"
+    return "string"
+
+
+class Column:
+    # What has been seen in one column: the narrowest kind that holds every
+    # value, the longest value and, while it is still a key candidate, the
+    # set of values.
+
+    def __init__(self, name, kind=None, length=0, digits=0, scale=0, max_abs=0):
+        self.name = name
+        self.kind = kind
+        self.length = length
+        self.digits = digits
+        self.scale = scale
+        self.max_abs = max_abs
+        self.count = 0
+        self.values = set()
+
+    def observe(self, value):
+        if value is None:
+            return
+        self.count += 1
+        kind = value_kind(value)
+        self.kind = widen(self.kind, kind)
+        self.length = max(self.length, len(value))
+        if kind == "int":
+            self.max_abs = max(self.max_abs, abs(int(value)))
+            self.digits = max(self.digits, len(value.lstrip("-")))
+        elif kind == "decimal":
+            whole, fraction = value.lstrip("-").split(".")
+            self.digits = max(self.digits, len(whole))
+            self.scale = max(self.scale, len(fraction))
+        if self.values is not None:
+            # Compared the way the warehouse's default collation compares
+            # keys: ignoring case and trailing spaces.
+            key = value.rstrip(" ").casefold()
+            if self.length > max_key_length or key in self.values:
+                self.values = None
+            else:
+                self.values.add(key)
+
+    def merge(self, other):
+        # Widen this column so it also holds everything other holds.
+        self.kind = widen(self.kind, other.kind)
+        self.length = max(self.length, other.length)
+        self.digits = max(self.digits, other.digits)
+        self.scale = max(self.scale, other.scale)
+        self.max_abs = max(self.max_abs, other.max_abs)
+
+    def sql_type(self):
+        if self.kind == "int":
+            return "INT" if self.max_abs < 2**31 else "BIGINT"
+        if self.kind == "decimal" and self.digits + self.scale <= 65:
+            return f"DECIMAL({self.digits + self.scale},{self.scale})"
+        if self.kind == "date":
+            return "DATE"
+        if self.kind == "datetime":
+            return "DATETIME"
+        for width in string_widths:
+            if self.length <= width:
+                return f"VARCHAR({width})"
+        return "TEXT"
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "length": self.length,
+            "digits": self.digits,
+            "scale": self.scale,
+            "max_abs": self.max_abs,
+        }
+
+
+class Schema:
+    # Column types and a candidate primary key inferred from every record of
+    # a reference table, not just the first one.
+
+    def __init__(self, columns=None, primary_key=None):
+        self.columns = dict((column.name, column) for column in columns or [])
+        self.primary_key = primary_key
+        self.records = 0
+
+    def observe(self, record):
+        self.records += 1
+        for name, value in record.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = Column(name)
+            column.observe(value)
+
+    def names(self):
+        return list(self.columns)
+
+    def infer_key(self, preferred=None):
+        # Keep the preferred key while it still holds, otherwise take the
+        # first column with a short, unique value in every record.
+        candidates = [
+            column.name
+            for column in self.columns.values()
+            if column.values is not None
+            and column.count == self.records
+            and column.kind in ("int", "string")
+        ]
+        if preferred in candidates:
+            self.primary_key = preferred
+        else:
+            self.primary_key = candidates[0] if candidates else None
+        return self.primary_key
+
+    def column_sql(self, column):
+        null = " NOT NULL" if column.name == self.primary_key else ""
+        return f"`{column.name}` {column.sql_type()}{null}"
+
+    def create_sql(self, table_name):
+        columns = [self.column_sql(column) for column in self.columns.values()]
+        if self.primary_key:
+            columns.append(f"PRIMARY KEY (`{self.primary_key}`)")
+        return f"CREATE TABLE {table_name} ({', '.join(columns)})"
+
+    def alter_sql(self, table_name, previous):
+        # ALTER statements that take a table created from previous to this
+        # schema, or None if nothing changed.
+        changes = []
+        for column in self.columns.values():
+            old = previous.columns.get(column.name)
+            if old is None:
+                changes.append(f"ADD COLUMN {self.column_sql(column)}")
+            elif old.sql_type() != column.sql_type():
+                changes.append(f"MODIFY COLUMN {self.column_sql(column)}")
+        if not changes:
+            return None
+        return f"ALTER TABLE {table_name} {', '.join(changes)}"
+
+    def widened(self, previous):
+        # This schema merged with previous, keeping previous's column order
+        # and any columns this payload did not have.
+        merged = Schema(
+            [Column(**column.to_dict()) for column in previous.columns.values()],
+            self.primary_key,
+        )
+        for column in self.columns.values():
+            if column.name in merged.columns:
+                merged.columns[column.name].merge(column)
+            else:
+                merged.columns[column.name] = Column(**column.to_dict())
+        return merged
+
+    def row_converter(self):
+        # Turn a record into a value tuple in column order. Dates are parsed
+        # from Spillman's format; empty values are NULL.
+        converters = []
+        for column in self.columns.values():
+            if column.kind == "date":
+                converters.append((column.name, timestamps.parse_date))
+            elif column.kind == "datetime":
+                converters.append((column.name, timestamps.parse_datetime))
+            else:
+                converters.append((column.name, None))
+
+        def convert(record):
+            values = []
+            for name, parse in converters:
+                value = record.get(name)
+                if value is not None and parse is not None:
+                    value = parse(value)
+                values.append(value)
+            return tuple(values)
+
+        return convert
+
+    def to_dict(self):
+        return {
+            "columns": [column.to_dict() for column in self.columns.values()],
+            "primary_key": self.primary_key,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            [Column(**column) for column in data["columns"]], data.get("primary_key")
+        )
+
+
+def cached_schema(table_name):
+    with schema_lock:
+        data = load_state(schema_file, {}).get(table_name)
+    return Schema.from_dict(data) if data else None
+
+
+def save_schema(table_name, schema):
+    with schema_lock:
+        schemas = load_state(schema_file, {})
+        schemas[table_name] = schema.to_dict()
+        save_state(schema_file, schemas)
@@ -23,5 +23,6 @@ if not os.path.exists(settings_file):
     print("settings.yaml not found!")
     sys.exit()
 
+# Parsed once per process, with libyaml when it is available.
 with open(settings_file, "r") as f:
-    settings_data = yaml.load(f, Loader=yaml.FullLoader)
+    settings_data = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
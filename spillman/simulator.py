@@ -0,0 +1,379 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+import zlib
+import logging
+import datetime
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+# Stand-in for the Spillman API used for offline load testing. Rows are
+# generated on demand from (seed, table, day, index), so any window of any
+# size can be answered without holding a day of data in memory, and the same
+# seed always produces the same data.
+
+default_rows = {
+    "CADMasterCallTable": 300,
+    "lwmain": 150,
+    "frmain": 80,
+    "emmain": 120,
+    "rlmain": 5000,
+    "rlavllog": 100000,
+    "MasterCitationTable": 50,
+    "MessengerMessageTable": 500,
+    "SystemLogTable": 2000,
+    "GeobaseAddressIDMaintenance": 150000,
+    "reference": 200,
+}
+
+datetime_format = "%H:%M:%S %m/%d/%Y"
+date_format = "%m/%d/%Y"
+filter_formats = ("%Y-%m-%d %H:%M:%S", "%m/%d/%Y %H:%M:%S", "%m/%d/%Y", "%Y-%m-%d")
+
+agencies = ("SCPD", "SCFD", "SCEMS", "IVPD", "IVFD")
+natures = ("TRAFFIC STOP", "MEDICAL", "FIRE ALARM", "WELFARE CHECK", "THEFT")
+units = tuple(f"{prefix}{n}" for prefix in ("E", "M", "P", "L") for n in range(1, 26))
+streets = ("MAIN ST", "CENTER ST", "RED MOUNTAIN DR", "PIONEER PKWY", "CANYON VIEW")
+cities = ("SC", "IV", "SG", "WA")
+tencodes = ("10-8", "10-7", "10-97", "10-23", "10-15")
+
+
+def pick(values, n):
+    return values[n % len(values)]
+
+
+def mix(*parts):
+    # Cheap deterministic pseudo-random integer for a tuple of values.
+    return zlib.crc32("|".join(str(part) for part in parts).encode("utf-8"))
+
+
+def parse_filter_value(value):
+    for fmt in filter_formats:
+        try:
+            return datetime.datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+    return int(value)
+
+
+class Generator:
+    def __init__(self, seed=1, rows=None):
+        self.seed = seed
+        self.rows = dict(default_rows)
+        self.rows.update(rows or {})
+
+    def per_day(self, table):
+        return self.rows.get(table, self.rows["reference"])
+
+    def timed(self, table, lo, hi):
+        # Rows for a time-keyed table are spread evenly over each day, so the
+        # index range matching a window can be computed instead of searched.
+        per_day = self.per_day(table)
+        if per_day <= 0:
+            return
+        step = 86400 / per_day
+        day = datetime.datetime.combine(lo.date(), datetime.time())
+
+        while day < hi:
+            first = max(0, int((lo - day).total_seconds() // step))
+            for i in range(first, per_day):
+                stamp = day + datetime.timedelta(seconds=int(i * step))
+                if stamp >= hi:
+                    break
+                if stamp > lo:
+                    yield self.row(table, day, i, stamp)
+            day += datetime.timedelta(days=1)
+
+    def row(self, table, day, i, stamp):
+        n = mix(self.seed, table, day.toordinal(), i)
+        ordinal = day.toordinal() - 730000
+        when = stamp.strftime(datetime_format)
+        earlier = (stamp - datetime.timedelta(minutes=n % 90)).strftime(datetime_format)
+        callid = f"{ordinal}{(i % 99999):05d}"
+        agency = pick(agencies, n)
+        unit = pick(units, n >> 3)
+        address = f"{n % 2000} {pick(streets, n >> 5)}"
+
+        if table == "CADMasterCallTable":
+            return {
+                "RecordNumber": callid,
+                "CallTypeLawFireEMS": pick("LFE", n),
+                "CallNature": pick(natures, n >> 2),
+                "CallPriority": str(n % 5 + 1),
+                "TimeDateReported": when,
+                "TimeDateOccurredEarliest": earlier,
+                "TimeDateOccurredLatest": when,
+                "RespondToAddress": address,
+                "CityCode": pick(cities, n >> 7),
+                "ComplainantNameNumber": str(n % 50000),
+                "HowReceived": pick(("911", "PHONE", "RADIO"), n),
+                "CallTaker": f"DISP{n % 12}",
+                "Determinant": f"{n % 35}-A-{n % 9}",
+            }
+        if table in ("lwmain", "frmain", "emmain"):
+            return {
+                "callid": callid,
+                "number": f"{table[:2].upper()}{callid}",
+                "nature": pick(natures, n >> 2),
+                "address": address,
+                "city": pick(cities, n >> 7),
+                "state": "UT",
+                "zip": "84765",
+                "locatn": f"BEAT{n % 8}",
+                "agency": agency,
+                "respoff": f"OFF{n % 60}",
+                "geoaddr": str(n % 150000),
+                "nameid": str(n % 50000),
+                "rcvby": pick(("911", "PHONE", "RADIO"), n),
+                "ocurdt1": earlier,
+                "ocurdt2": when,
+                "dtrepor": when,
+                "dispdat": stamp.strftime(date_format),
+                "contact": f"CONTACT {n % 400}",
+                "condtkn": pick(("CLR", "RPT", "ARR"), n),
+                "dispos": pick(("CLOSED", "OPEN", "REFERRED"), n >> 4),
+            }
+        if table == "rlmain":
+            return {
+                "logdate": when,
+                "xpos": f"-113{n % 1000000:06d}",
+                "ypos": f"37{(n >> 4) % 1000000:06d}",
+                "seq": str(i),
+                "callid": callid,
+                "agency": agency,
+                "zone": f"Z{n % 20}",
+                "tencode": pick(tencodes, n >> 6),
+                "unit": unit,
+                "desc": f"STATUS {pick(tencodes, n >> 6)}",
+                "dpatchr": f"DISP{n % 12}",
+                "calltyp": pick("LFE", n),
+            }
+        if table == "rlavllog":
+            return {
+                "callid": callid,
+                "agency": agency,
+                "assgnmt": unit,
+                "stcode": pick(("AV", "ER", "OS", "TR"), n),
+                "xlng": f"-113.{n % 1000000:06d}",
+                "ylat": f"37.{(n >> 4) % 1000000:06d}",
+                "heading": str(n % 360),
+                "speed": str(n % 80),
+                "logdate": when,
+            }
+        if table == "MasterCitationTable":
+            return {
+                "CitationNumber": f"C{callid}",
+                "NameNumber": str(n % 50000),
+                "DateOfCitation": stamp.strftime(date_format),
+                "AgencyCode": agency,
+                "ViolationDate": earlier,
+                "BondAmount": str(n % 500),
+                "Actual": str(n % 400),
+                "Posted": "0",
+                "Safe": "0",
+                "IssuingOfficer": f"OFF{n % 60}",
+                "CourtCode": "SCJC",
+                "AreaLocationCode": f"Z{n % 20}",
+                "StreetAddress": address,
+                "City": pick(cities, n >> 7),
+                "StateAbbreviation": "UT",
+                "ZIPCode": "84765",
+                "VehicleNumber": str(n % 90000),
+                "CitationType": pick(("T", "C", "W"), n),
+                "GeobaseAddressID": str(n % 150000),
+                "LawIncident": f"LW{callid}",
+            }
+        if table == "MessengerMessageTable":
+            return {
+                "MessageNumber": callid,
+                "MessageSender": f"DISP{n % 12}",
+                "Recipient": unit,
+                "MessageSubject": pick(natures, n),
+                "MessageData": f"<message><html>Respond to {address}</html></message>",
+                "WhenReceived": when,
+            }
+        if table == "SystemLogTable":
+            return {
+                "UserID": f"USER{n % 40}",
+                "ModeUsed": pick(("Q", "A", "U"), n),
+                "TableBeingAccessed": pick(("lwmain", "cdunit", "apnames"), n >> 3),
+                "MiscellaneousData": f"record {n % 100000}",
+                "TimeOfAccess": when,
+            }
+        return self.reference_row(table, i)
+
+    def geobase(self, lo, hi):
+        top = self.per_day("GeobaseAddressIDMaintenance")
+        for address_id in range(max(lo + 1, 1), min(hi, top + 1)):
+            n = mix(self.seed, "geobase", address_id)
+            if n % 10 == 0:
+                continue
+            yield {
+                "IDNumberOfAddress": str(address_id),
+                "HouseNumber": str(n % 5000),
+                "StreetAddress": pick(streets, n >> 3),
+                "CityCode": pick(cities, n >> 7),
+                "ZIP": "84765",
+                "ZoneLa": f"L{n % 20}",
+                "ZoneFa": f"F{n % 10}",
+                "ZoneEa": f"E{n % 10}",
+                "YCoordinate": str(37000000 + n % 200000),
+                "XCoordinate": str(-113500000 - n % 200000),
+            }
+
+    def reference(self, table):
+        for i in range(self.per_day(table)):
+            yield self.reference_row(table, i)
+
+    def reference_row(self, table, i):
+        n = mix(self.seed, table, i)
+        return {
+            "code": f"{table[:3].upper()}{i}",
+            "desc": f"{table} {pick(natures, n)}",
+            "agency": pick(agencies, n),
+            "updated": f"12:00:00 01/{i % 28 + 1:02d}/2020",
+            "count": str(n % 1000),
+        }
+
+
+# Field each table is filtered on in the queries spillman-etl issues.
+query_fields = {
+    "CADMasterCallTable": "TimeDateReported",
+    "lwmain": "dispdat",
+    "frmain": "dispdat",
+    "emmain": "dispdat",
+    "rlmain": "logdate",
+    "rlavllog": "logdate",
+    "MasterCitationTable": "DateOfCitation",
+    "MessengerMessageTable": "WhenReceived",
+    "SystemLogTable": "TimeOfAccess",
+    "GeobaseAddressIDMaintenance": "IDNumberOfAddress",
+}
+
+# Query fields Spillman holds as dates without a time.
+date_fields = {"dispdat", "DateOfCitation"}
+
+
+def parse_query(body):
+    root = ET.fromstring(body)
+    table_elem = root.find("./PublicSafety/Query/*")
+    bounds = {}
+    for elem in table_elem:
+        bounds[(elem.tag, elem.get("search_type"))] = parse_filter_value(elem.text)
+    return table_elem.tag, bounds
+
+
+def matching_rows(generator, table, bounds):
+    field = query_fields.get(table)
+    if field is None:
+        return generator.reference(table)
+
+    lo = bounds.get((field, "greater_than"))
+    hi = bounds.get((field, "less_than"))
+
+    if table == "GeobaseAddressIDMaintenance":
+        return generator.geobase(-1 if lo is None else lo, 10**9 if hi is None else hi)
+
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    lo = lo if lo is not None else today - datetime.timedelta(days=1)
+    hi = hi if hi is not None else today
+    if field in date_fields:
+        # Date-only field: rows dated strictly after lo and before hi.
+        lo = datetime.datetime.combine(lo.date(), datetime.time())
+        lo += datetime.timedelta(days=1, seconds=-1)
+        hi = datetime.datetime.combine(hi.date(), datetime.time())
+    return generator.timed(table, lo, hi)
+
+
+def serialize(table, row):
+    fields = "".join(f"<{key}>{escape(value)}</{key}>" for key, value in row.items())
+    return f"<{table}>{fields}</{table}>"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        except ConnectionResetError:
+            self.close_connection = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        try:
+            table, bounds = parse_query(body)
+        except Exception as e:
+            self.send_error(400, f"Bad query: {e}")
+            return
+
+        started = time.monotonic()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        self.write_chunk(
+            '<?xml version="1.0" encoding="utf-8"?>'
+            '<PublicSafetyEnvelope version="1.0"><PublicSafety id=""><Response>'
+        )
+        rows = 0
+        page = []
+        try:
+            for row in matching_rows(self.server.generator, table, bounds):
+                page.append(serialize(table, row))
+                rows += 1
+                if len(page) >= self.server.page_size:
+                    self.write_chunk("".join(page))
+                    page = []
+            page.append("</Response></PublicSafety></PublicSafetyEnvelope>")
+            self.write_chunk("".join(page))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. a probe or a window split.
+            self.close_connection = True
+            logging.debug(f"Client closed {table} response after {rows} rows")
+            return
+
+        logging.info(
+            f"Simulated {table}: {rows} rows in {time.monotonic() - started:.2f}s"
+        )
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def serve(host="127.0.0.1", port=8080, seed=1, rows=None, latency=0, page_size=500):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.generator = Generator(seed, rows)
+    server.latency = latency
+    server.page_size = max(page_size, 1)
+    logging.info(f"Spillman simulator listening on http://{host}:{port}/")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,302 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import time
+import glob
+import zlib
+import pickle
+import struct
+import logging
+import threading
+from itertools import islice
+from contextlib import contextmanager
+from . import keyindex
+from .loadtable import BatchWriter
+from .runner import run_task, summary
+from .settings import settings_data
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+spool_settings = settings_data.get("spool") or {}
+spool_enabled = spool_settings.get("enabled", False)
+spool_dir = spool_settings.get("dir", "./spillman/spool")
+segment_bytes = spool_settings.get("segment_mb", 64) * 1024 * 1024
+spool_loaders = spool_settings.get("loaders", 2)
+spool_poll = spool_settings.get("poll_seconds", 1)
+
+# Each frame is a 4-byte length and a 4-byte CRC-32 followed by a pickled
+# (table, columns, duplicates, rows) batch. Segments are written as .open,
+# fsynced and renamed to .seg when full, claimed by a loader as .loading and
+# deleted once their rows are committed. A segment that fails its checks is
+# renamed to .corrupt and never loaded; only one sealed by recover() after
+# its writer died, named .recovered.seg, may end in a torn frame.
+frame_header = struct.Struct(">II")
+_segment_counter = 0
+_segment_lock = threading.Lock()
+
+
+def set_spool(enabled):
+    # None keeps the spool.enabled setting.
+    global spool_enabled
+    if enabled is not None:
+        spool_enabled = enabled
+
+
+def segment_name():
+    global _segment_counter
+    with _segment_lock:
+        _segment_counter += 1
+        counter = _segment_counter
+    return f"{time.time_ns()}-{os.getpid()}-{counter}"
+
+
+class SpoolWriter:
+    # Appends batches of transformed rows to the spool, starting a new
+    # segment whenever the current one reaches spool.segment_mb.
+
+    def __init__(self):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.f = None
+        self.path = None
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Batches written before a failure are complete frames, so the
+        # segment is sealed either way and loaded like any other.
+        self.seal()
+
+    def append(self, table, columns, rows, duplicates="skip"):
+        if not rows:
+            return
+        payload = pickle.dumps(
+            (table, tuple(columns), duplicates, rows), pickle.HIGHEST_PROTOCOL
+        )
+        if self.f is None:
+            self.path = os.path.join(spool_dir, f"{segment_name()}.open")
+            self.f = open(self.path, "wb")
+        self.f.write(frame_header.pack(len(payload), zlib.crc32(payload)))
+        self.f.write(payload)
+        self.rows += len(rows)
+        if self.f.tell() >= segment_bytes:
+            self.seal()
+
+    def seal(self):
+        if self.f is None:
+            return
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.path, self.path[: -len(".open")] + ".seg")
+        self.f = None
+        self.path = None
+
+
+class CorruptSegment(Exception):
+    pass
+
+
+def scan_frames(path, torn_tail=False):
+    # Yield the payload of every frame, raising CorruptSegment at a short or
+    # damaged one. A segment recover() sealed for a dead writer may end in a
+    # frame the writer never finished; with torn_tail that last frame is
+    # dropped instead.
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        while True:
+            offset = f.tell()
+            header = f.read(frame_header.size)
+            if not header:
+                return
+            if len(header) == frame_header.size:
+                length, crc = frame_header.unpack(header)
+                payload = f.read(length)
+                if len(payload) == length and zlib.crc32(payload) == crc:
+                    yield payload
+                    continue
+            if torn_tail and f.tell() == size:
+                logging.warning(f"Dropping unfinished last frame of {path}")
+                return
+            raise CorruptSegment(f"Corrupt frame at byte {offset} of {path}")
+
+
+def read_frames(path, torn_tail=False):
+    # Every frame is checked before the first is handed on, so a corrupt
+    # segment loads nothing at all.
+    frames = sum(1 for _ in scan_frames(path, torn_tail))
+    for payload in islice(scan_frames(path, torn_tail), frames):
+        yield pickle.loads(payload)
+
+
+def recover():
+    # Seal .open segments left behind by extract processes that died, so
+    # their complete frames are loaded instead of pulled again, and release
+    # segments claimed by loaders that died before acknowledging them.
+    for path in glob.glob(os.path.join(spool_dir, "*.open")):
+        pid = int(os.path.basename(path).split("-")[1])
+        if pid == os.getpid() or pid_alive(pid):
+            continue
+        logging.warning(f"Recovering spool segment {path}")
+        os.replace(path, path[: -len(".open")] + ".recovered.seg")
+
+    for path in glob.glob(os.path.join(spool_dir, "*.loading")):
+        base, pid, suffix = path.rsplit(".", 2)
+        if int(pid) == os.getpid() or pid_alive(int(pid)):
+            continue
+        logging.warning(f"Releasing spool segment {path}")
+        os.replace(path, f"{base}.seg")
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def claim(skip=()):
+    # Rename the oldest sealed segment to .loading so no other loader, in
+    # this process or another, picks it up.
+    for path in sorted(glob.glob(os.path.join(spool_dir, "*.seg"))):
+        if path in skip:
+            continue
+        claimed = f"{path[: -len('.seg')]}.{os.getpid()}.loading"
+        try:
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            continue
+        return path, claimed
+    return None, None
+
+
+def load_segment(path):
+    rows = 0
+    indexes = {}
+    torn_tail = ".recovered." in os.path.basename(path)
+    with BatchWriter() as writer:
+        for table, columns, duplicates, batch in read_frames(path, torn_tail):
+            writer.add(table, columns, batch, duplicates)
+            rows += len(batch)
+            if table not in indexes:
+                indexes[table] = keyindex.for_table(table)
+            if indexes[table]:
+                indexes[table].stage(batch)
+
+    for index in indexes.values():
+        if index:
+            index.commit(writer.rejected)
+    logging.info(f"Loaded spool segment {os.path.basename(path)}: {rows} rows")
+    return rows
+
+
+def loader(stop, failed, results):
+    # Drain segments until stop is set and none are left. A segment that
+    # fails to load is put back for a later drain and not retried here.
+    while True:
+        # Checked before claiming, so a segment sealed just before stop was
+        # set is still picked up.
+        stopping = stop is None or stop.is_set()
+        path, claimed = claim(failed)
+        if path is None:
+            if stopping:
+                return
+            time.sleep(spool_poll)
+            continue
+
+        result = run_task(f"load {os.path.basename(path)}", load_segment, claimed)
+        if result["status"] == "ok":
+            os.remove(claimed)
+        elif result["error"].startswith("Corrupt frame"):
+            # Its rows are checkpointed as extracted, so the segment is kept
+            # aside for someone to look at rather than retried or deleted.
+            corrupt = f"{path[: -len('.seg')]}.corrupt"
+            logging.error(f"Moving corrupt spool segment to {corrupt}")
+            os.replace(claimed, corrupt)
+        else:
+            os.replace(claimed, path)
+            failed.add(path)
+        results.append(result)
+
+
+def drain(workers=None, stop=None):
+    # Load every sealed segment with workers loader threads. With a stop
+    # event the loaders keep waiting for new segments until it is set.
+    os.makedirs(spool_dir, exist_ok=True)
+    recover()
+
+    failed = set()
+    results = []
+    threads = [
+        threading.Thread(
+            target=loader, args=(stop, failed, results), name=f"spool-loader-{i}"
+        )
+        for i in range(workers or spool_loaders)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if results:
+        summary(results)
+    return results
+
+
+def in_flight():
+    # Segments claimed by loader threads of this process.
+    return glob.glob(os.path.join(spool_dir, f"*.{os.getpid()}.loading"))
+
+
+def load_spooled(workers=None):
+    # Drain what is spooled now, failing if any of it could not be loaded.
+    # Segments the loaders of a draining() block are still loading count as
+    # spooled now: wait for them, then drain again for any they put back.
+    results = []
+    while True:
+        results.extend(drain(workers))
+        if not in_flight():
+            break
+        while in_flight():
+            time.sleep(spool_poll)
+    failed = [result["name"] for result in results if result["status"] != "ok"]
+    if failed:
+        raise RuntimeError(f"Spooled rows not loaded: {', '.join(failed)}")
+
+
+@contextmanager
+def draining(workers=None):
+    # Run loader threads for as long as the block runs, so producers in it
+    # are loaded as they spool. The list yielded holds the loader results
+    # once the block has exited.
+    stop = threading.Event()
+    loaded = []
+    thread = threading.Thread(
+        target=lambda: loaded.extend(drain(workers, stop)), name="spool-drain"
+    )
+    thread.start()
+    try:
+        yield loaded
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,49 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import json
+import logging
+import threading
+from .settings import settings_data
+
+state_dir = settings_data["global"].get("state_dir", "./spillman/state")
+
+
+def state_path(name):
+    os.makedirs(state_dir, exist_ok=True)
+    return os.path.join(state_dir, name)
+
+
+def load_state(name, default=None):
+    try:
+        with open(state_path(name), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        logging.warning(f"Ignoring unreadable state file {name}")
+        return default
+
+
+def save_state(name, data):
+    # Write to a private temp file and rename over the old one so a crash or a
+    # concurrent writer never leaves a half-written state file behind.
+    path = state_path(name)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True, default=str)
+    os.replace(tmp, path)
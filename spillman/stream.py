@@ -0,0 +1,129 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+import logging
+import datetime
+import threading
+from . import checkpoint, facts, keyindex
+from .mapping import mappings
+from .runner import run_task
+from .settings import settings_data
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+stream_settings = settings_data.get("stream") or {}
+stream_tables = stream_settings.get(
+    "tables", ["cad", "lawincident", "fireincident", "emsincident", "rlog", "avl"]
+)
+stream_poll = stream_settings.get("poll_seconds", 60)
+stream_overlap = datetime.timedelta(seconds=stream_settings.get("overlap_seconds", 300))
+stream_skew = datetime.timedelta(seconds=stream_settings.get("skew_seconds", 300))
+stream_start = datetime.timedelta(hours=stream_settings.get("start_hours", 24))
+
+# Each table's high-water mark is the newest query_field value loaded so far,
+# taken from Spillman's own timestamps rather than this host's clock. A poll
+# asks for everything from the mark minus stream.overlap_seconds, which
+# picks up records committed late or stamped slightly out of order; rows
+# already loaded are dropped by the key index or skipped by the warehouse.
+
+
+def unfiltered(tables=None):
+    # Tables whose repeated overlap rows nothing would drop: the warehouse
+    # has no unique key for them and no key index filters them.
+    return [
+        name
+        for name in tables or stream_tables
+        if not mappings[name].unique_key
+        and keyindex.for_table(mappings[name].target) is None
+    ]
+
+
+def mark_position(mapping):
+    # The column holding the converted query_field, if the mapping has one.
+    for i, field in enumerate(mapping.fields):
+        if field.get("source") == mapping.query_field and field.get("convert") in (
+            "datetime",
+            "date",
+        ):
+            return i
+    return None
+
+
+def poll(name):
+    # Load what is new in one table since its mark and advance the mark.
+    # Nothing is recorded unless the load completes, so a failed poll is
+    # simply repeated.
+    mapping = mappings[name]
+    now = datetime.datetime.now()
+    mark = checkpoint.watermark(f"stream {name}") or now - stream_start
+    # Looking past this host's clock covers a Spillman clock running ahead.
+    end = now + stream_skew
+    if mapping.window == "time":
+        start = mark - stream_overlap
+    else:
+        # Date-only fields are filtered by whole days: from the mark's day
+        # through the day end falls on.
+        start = datetime.datetime.combine(mark.date(), datetime.time())
+        end = datetime.datetime.combine(
+            end.date() + datetime.timedelta(days=1), datetime.time()
+        )
+
+    # Without a timestamp column to read, the mark follows this host's clock.
+    position = mark_position(mapping)
+    newest = [mark if position is not None else now]
+
+    def observe(rows):
+        for row in rows:
+            value = row[position]
+            if not isinstance(value, datetime.datetime):
+                value = datetime.datetime.combine(value, datetime.time())
+            if value > newest[0]:
+                newest[0] = value
+
+    loaded = facts.load(
+        mapping,
+        facts.fetch(mapping, start, end),
+        observe if position is not None else None,
+    )
+
+    # A mark beyond the window is a bad timestamp; it would stop the table
+    # from ever being polled for the records before it.
+    mark = min(newest[0], end)
+    checkpoint.set_watermark(f"stream {name}", mark)
+    logging.debug(f"Stream {name}: {loaded} rows, mark {mark}")
+    return loaded
+
+
+def follow(tables=None, poll_seconds=None, stop=None):
+    # Poll tables every poll_seconds until stop is set. A table whose poll
+    # fails keeps its mark and is tried again on the next round.
+    tables = tables or stream_tables
+    poll_seconds = poll_seconds or stream_poll
+    stop = stop or threading.Event()
+    logging.info(f"Streaming {', '.join(tables)} every {poll_seconds}s")
+
+    while not stop.is_set():
+        started = time.monotonic()
+        for name in tables:
+            if stop.is_set():
+                break
+            run_task(f"stream {name}", poll, name)
+        stop.wait(max(0, poll_seconds - (time.monotonic() - started)))
+
+    logging.info("Stream stopped")
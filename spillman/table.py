@@ -16,86 +16,251 @@
 # limitations under the License.
 import sys
 import urllib.request as urlreq
-import json
 import logging
-import requests
-import xmltodict
+import itertools
 import traceback
 import datetime
+import pickle
+import hashlib
+import threading
+import tempfile
 from .loadtable import *
+from .schema import Schema, cached_schema, save_schema
+from .client import query
+from .runner import run
 from .settings import settings_data
-from .database import db
-
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+from .database import connection
+from .state import load_state, save_state
 
 logging.basicConfig(
     format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
 )
 
-api_url = settings_data["spillman"]["url"]
-api_usr = settings_data["spillman"]["user"]
-api_pwd = settings_data["spillman"]["password"]
+reference_settings = settings_data.get("reference") or {}
+reference_sync = reference_settings.get("sync", "delta")
+reference_workers = reference_settings.get("workers", 4)
 
-session = requests.Session()
-session.auth = (api_usr, api_pwd)
+# Concurrent imports share these: api_slots bounds how many tables are being
+# pulled from Spillman at once, db_slots how many are being written.
+api_slots = threading.BoundedSemaphore(reference_settings.get("api_concurrency", 4))
+db_slots = threading.BoundedSemaphore(reference_settings.get("db_concurrency", 2))
 
 
-def spillman(table):
-    logging.info(f"Processing Spillman Table {table}")
-    headers = {"Content-Type": "application/xml"}
+def import_tables(tables, full=False, workers=None):
+    tasks = [(f"table {table}", spillman, (table, full)) for table in tables]
+    return run(tasks, workers or reference_workers)
 
+
+def spillman(table, full=False):
+    logging.info(f"Processing Spillman Table {table}")
     try:
-        request = f"""
-            <PublicSafetyEnvelope version="1.0">
-                <PublicSafety id="">
-                    <Query>
-                        <{table}>
-                        </{table}>
-                    </Query>
-                </PublicSafety>
-            </PublicSafetyEnvelope>
-        """
-        table_xml = session.post(api_url, data=request, headers=headers, verify=False)
-        table_decoded = table_xml.content.decode("utf-8")
-        tabledata = json.loads(json.dumps(xmltodict.parse(table_decoded)))
-        tabledata = tabledata["PublicSafetyEnvelope"]["PublicSafety"]["Response"][
-            f"{table}"
-        ]
-
-        create_table(table, tabledata)
+        tabledata = query(table)
+
+        create_table(table, tabledata, full)
 
     except Exception as e:
         logging.error(f"Error processing Spillman Table {table}: {e}")
+        raise
+
+
+def create_table(table_name, tabledata, full=False):
+    # The payload is spooled to disk while its schema is inferred. If the
+    # live table already has that schema and a primary key, only the rows
+    # whose fingerprint changed since the last import are written; otherwise
+    # the table is rebuilt in a shadow copy and swapped in.
+    shadow = f"{table_name}_shadow"
+    schema = Schema()
+
+    with tempfile.TemporaryFile(dir=loader_tmp_dir) as spool:
+        with api_slots:
+            for record in tabledata:
+                schema.observe(record)
+                pickle.dump(record, spool, pickle.HIGHEST_PROTOCOL)
+
+        if not schema.records:
+            logging.info(f"No rows returned for Spillman Table {table_name}")
+            return
 
+        with db_slots:
+            load_table(table_name, shadow, schema, spool, full)
 
-def create_table(table_name, tabledata):
-    keys = list(tabledata[0].keys())
 
+def load_table(table_name, shadow, schema, spool, full):
     try:
-        db = connect()
-        cursor = db.cursor()
+        target, ddl, unchanged = shadow_schema(table_name, shadow, schema)
+        previous = load_state(fingerprint_file(table_name))
+        if (
+            unchanged
+            and target.primary_key
+            and previous is not None
+            and reference_sync == "delta"
+            and not full
+        ):
+            spool.seek(0)
+            if sync_table(table_name, target, spooled(spool), previous, schema.records):
+                return
 
-        cursor.execute(f"DROP TABLE IF EXISTS {table_name}_test;")
-        cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+        spool.seek(0)
+        replace_table(table_name, shadow, target, ddl, spooled(spool), schema.records)
+
+    except Exception:
+        drop_table(shadow)
+        raise
+
+
+def replace_table(table_name, shadow, schema, ddl, records, expected):
+    # Load into a shadow table and swap it in with one RENAME, so readers
+    # never see the table missing or half loaded and a failed import leaves
+    # the current table in place.
+    with connection() as db:
+        with db.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}_test;")
+            cursor.execute(f"DROP TABLE IF EXISTS {shadow};")
+            for statement in ddl:
+                cursor.execute(statement)
         db.commit()
 
-        cursor.execute(
-            f"CREATE TABLE {table_name} ({', '.join([f'`{key}` VARCHAR(255)' for key in keys])})"
-        )
+    fingerprints = {}
+    rows = fingerprinted(records, schema, fingerprints)
+    columns = schema.names()
+    with BatchWriter() as writer:
+        for batch in iter(lambda: list(itertools.islice(rows, loader_batch_rows)), []):
+            writer.add(shadow, columns, batch)
+
+    with connection() as db:
+        with db.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {shadow}")
+            loaded = cursor.fetchone()[0]
+            if loaded != expected:
+                raise ValueError(
+                    f"{shadow} has {loaded} rows, expected {expected}; keeping {table_name}"
+                )
+            swap_table(cursor, table_name, shadow)
         db.commit()
 
-        for row in tabledata:
-            values = [row.get(key, None) for key in keys]
-            insert_query = f"INSERT INTO {table_name} ({', '.join(['`' + key + '`' for key in keys])}) VALUES ({', '.join(['%s' for _ in keys])})"
-            cursor.execute(insert_query, tuple(values))
+    save_schema(table_name, schema)
+    save_state(
+        fingerprint_file(table_name), fingerprints if schema.primary_key else None
+    )
+    logging.info(f"Loaded {loaded} rows into {table_name}")
 
+
+def sync_table(table_name, schema, records, previous, expected):
+    # Upsert the rows whose fingerprint differs from the last import and
+    # delete the keys that are gone. Returns False, leaving the caller to
+    # rebuild the table, if the result does not have the expected row count.
+    fingerprints = {}
+    columns = schema.names()
+    with BatchWriter() as writer:
+        for key, fingerprint, row in fingerprinted(records, schema, fingerprints, True):
+            if previous.get(key) != fingerprint:
+                writer.add(table_name, columns, [row], "update")
+
+    deleted = [key for key in previous if key not in fingerprints]
+    with connection() as db:
+        with db.cursor() as cursor:
+            for start in range(0, len(deleted), loader_batch_rows):
+                keys = deleted[start : start + loader_batch_rows]
+                cursor.execute(
+                    f"DELETE FROM {table_name} WHERE `{schema.primary_key}` IN ({', '.join(['%s'] * len(keys))})",
+                    keys,
+                )
+            cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+            loaded = cursor.fetchone()[0]
         db.commit()
-        cursor.close()
-        db.close()
+
+    counts = writer.counts
+    logging.info(
+        f"Synced {table_name}: {counts['inserted']} inserted, {counts['updated']} updated, {len(deleted)} deleted"
+    )
+    if loaded != expected:
+        logging.warning(
+            f"{table_name} has {loaded} rows after sync, expected {expected}; rebuilding"
+        )
+        return False
+
+    save_schema(table_name, schema)
+    save_state(fingerprint_file(table_name), fingerprints)
+    return True
+
+
+def fingerprinted(records, schema, fingerprints, keyed=False):
+    # Convert records to rows, recording a content hash per primary key.
+    convert = schema.row_converter()
+    index = schema.names().index(schema.primary_key) if schema.primary_key else None
+    for record in records:
+        row = convert(record)
+        if index is None:
+            yield row
+            continue
+        key = str(row[index])
+        fingerprint = fingerprints[key] = hashlib.sha1(
+            repr(row).encode("utf-8")
+        ).hexdigest()
+        yield (key, fingerprint, row) if keyed else row
+
+
+def fingerprint_file(table_name):
+    return f"{table_name}.fingerprints.json"
+
+
+def shadow_schema(table_name, shadow, schema):
+    # The schema to load with, the DDL that creates the shadow table and
+    # whether the live table already has that schema. When the table was
+    # created from a cached schema with the same key, the shadow copies it
+    # and is only altered where this payload needs wider or new columns.
+    previous = cached_schema(table_name)
+    schema.infer_key(previous.primary_key if previous else None)
+
+    if (
+        previous
+        and previous.primary_key == schema.primary_key
+        and table_exists(table_name)
+    ):
+        target = schema.widened(previous)
+        ddl = [f"CREATE TABLE {shadow} LIKE {table_name}"]
+        alter = target.alter_sql(shadow, previous)
+        if alter:
+            logging.info(f"Schema of {table_name} changed: {alter}")
+            ddl.append(alter)
+        return target, ddl, alter is None
+
+    logging.info(f"Creating {table_name} with key {schema.primary_key}")
+    return schema, [schema.create_sql(shadow)], False
+
+
+def spooled(spool):
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
+
+
+def table_exists(table_name):
+    with connection() as db:
+        with db.cursor() as cursor:
+            cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+            return cursor.fetchone() is not None
+
+
+def swap_table(cursor, table_name, shadow):
+    cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+    if cursor.fetchone() is None:
+        cursor.execute(f"RENAME TABLE {shadow} TO {table_name}")
+        return
+
+    cursor.execute(f"DROP TABLE IF EXISTS {table_name}_old")
+    cursor.execute(
+        f"RENAME TABLE {table_name} TO {table_name}_old, {shadow} TO {table_name}"
+    )
+    cursor.execute(f"DROP TABLE {table_name}_old")
+
+
+def drop_table(table_name):
+    try:
+        with connection() as db:
+            with db.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
     except Exception as e:
-        cursor.close()
-        db.close()
-        logging.error(f"Error with table {table_name}: {e}")
-        logging.error(traceback.format_exc())
+        logging.error(f"Error dropping {table_name}: {e}")
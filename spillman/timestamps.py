@@ -0,0 +1,101 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import datetime
+from functools import lru_cache
+
+# Spillman sends datetimes as "HH:MM:SS MM/DD/YYYY" and dates as "MM/DD/YYYY".
+# Values missing or not in that shape become the 1900-01-01 placeholder the
+# warehouse already uses for unknown dates.
+missing_datetime = datetime.datetime(1900, 1, 1)
+missing_date = datetime.date(1900, 1, 1)
+epoch = datetime.datetime(1970, 1, 1)
+midnight = datetime.time()
+
+
+@lru_cache(maxsize=131072)
+def parse_datetime(value):
+    if len(value) == 10:
+        # Some date fields (DateOfCitation) are sent without a time.
+        date = parse_date(value)
+        return None if date is None else datetime.datetime.combine(date, midnight)
+    if (
+        len(value) != 19
+        or value[2] != ":"
+        or value[5] != ":"
+        or value[8] != " "
+        or value[11] != "/"
+        or value[14] != "/"
+    ):
+        return None
+    try:
+        return datetime.datetime(
+            int(value[15:19]),
+            int(value[9:11]),
+            int(value[12:14]),
+            int(value[0:2]),
+            int(value[3:5]),
+            int(value[6:8]),
+        )
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=16384)
+def parse_date(value):
+    if len(value) != 10 or value[2] != "/" or value[5] != "/":
+        return None
+    try:
+        return datetime.date(int(value[6:10]), int(value[0:2]), int(value[3:5]))
+    except ValueError:
+        return None
+
+
+def datetime_column(values, default=missing_datetime):
+    return _convert_column(values, parse_datetime, default)
+
+
+def date_column(values, default=missing_date):
+    return _convert_column(values, parse_date, default)
+
+
+def epoch_column(values, default=None):
+    # Seconds since 1970-01-01 for each Spillman datetime, for consumers that
+    # want integers rather than datetime objects.
+    return [
+        default if value is None else int((value - epoch).total_seconds())
+        for value in datetime_column(values, None)
+    ]
+
+
+def _convert_column(values, parse, default):
+    # Parse each distinct value once; AVL and radio log batches repeat the same
+    # timestamp many times.
+    parsed = {None: default}
+    invalid = 0
+    for value in set(values):
+        if value is None:
+            continue
+        result = parse(value)
+        if result is None:
+            invalid += 1
+            result = default
+        parsed[value] = result
+
+    if invalid:
+        logging.debug(f"Replaced {invalid} malformed timestamps with {default}")
+    return [parsed[value] for value in values]
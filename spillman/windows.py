@@ -0,0 +1,178 @@
+# **********************************************************
+# * CATEGORY  SOFTWARE
+# * GROUP     DISPATCH/WAREHOUSING
+# * AUTHOR    LANCE HAYNIE <LHAYNIE@SCCITY.ORG>
+# **********************************************************
+# Spillman-ETL
+# Copyright Santa Clara City
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.#
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import datetime
+import threading
+from contextlib import closing
+from . import cache
+from .client import query, between
+from .settings import settings_data
+from .state import load_state, save_state
+
+logging.basicConfig(
+    format="%(levelname)s - %(message)s", level=settings_data["global"]["loglevel"]
+)
+
+window_settings = settings_data.get("windows") or {}
+default_window = datetime.timedelta(hours=window_settings.get("default_hours", 24))
+min_window = datetime.timedelta(seconds=window_settings.get("min_seconds", 300))
+max_rows = window_settings.get("max_rows", 50000)
+target_rows = window_settings.get("target_rows", 20000)
+
+state_file = "windows.json"
+_learned = None
+_learned_lock = threading.Lock()
+
+
+class WindowTooLarge(Exception):
+    pass
+
+
+def learned_rates():
+    global _learned
+    with _learned_lock:
+        if _learned is None:
+            _learned = load_state(state_file, {})
+        return _learned
+
+
+def window_size(table):
+    rate = learned_rates().get(table)
+    if not rate:
+        return default_window
+
+    seconds = target_rows / rate
+    return max(min_window, min(default_window, datetime.timedelta(seconds=seconds)))
+
+
+def learn(table, rows, span):
+    # Rows per second, smoothed so one quiet or busy window does not swing the
+    # next run's starting size too far.
+    seconds = max(span.total_seconds(), 1)
+    rate = max(rows, 1) / seconds
+    rates = learned_rates()
+    with _learned_lock:
+        previous = rates.get(table)
+        rates[table] = rate if previous is None else (previous + rate) / 2
+
+
+def save_rates():
+    with _learned_lock:
+        current = load_state(state_file, {})
+        current.update(_learned or {})
+        save_state(state_file, current)
+
+
+def query_windows(table, field, start, end, fmt="%Y-%m-%d %H:%M:%S"):
+    # Yield every record of table whose field falls in [start, end), asking the
+    # API for one window at a time. A window that errors, times out or returns
+    # more than max_rows is bisected until it succeeds or reaches min_window;
+    # nothing from a window is yielded until it has been read in full.
+    if cache.replay:
+        yield from replay_windows(table, field, start, end, fmt)
+        return
+
+    size = window_size(table)
+    cursor = start
+
+    while cursor < end:
+        window_end = min(cursor + size, end)
+        pending = [(cursor, window_end)]
+
+        while pending:
+            lo, hi = pending.pop()
+            try:
+                rows = yield from _fetch(table, field, lo, hi, fmt)
+            except Exception as e:
+                if isinstance(e, WindowTooLarge):
+                    learn(table, max_rows, hi - lo)
+                if hi - lo <= min_window:
+                    raise
+                mid = lo + (hi - lo) / 2
+                mid = mid.replace(microsecond=0)
+                logging.info(f"Splitting {table} window {lo} to {hi}: {e}")
+                pending.append((mid, hi))
+                pending.append((lo, mid))
+                continue
+
+            learn(table, rows, hi - lo)
+
+        cursor = window_end
+        size = window_size(table)
+
+    save_rates()
+
+
+def replay_windows(table, field, start, end, fmt):
+    # Window sizes adapt between runs, so replay walks the windows that were
+    # actually cached instead of planning new ones. Overlapping entries left
+    # by runs with different window sizes are skipped.
+    cached = []
+    for entry in cache.entries(table):
+        bounds = dict(
+            (search_type, value)
+            for f, search_type, value in entry["filters"]
+            if f == field
+        )
+        try:
+            lo = datetime.datetime.strptime(bounds["greater_than"], fmt)
+            hi = datetime.datetime.strptime(bounds["less_than"], fmt)
+        except (KeyError, ValueError):
+            continue
+        lo += datetime.timedelta(seconds=1)
+        if lo < end and hi > start:
+            cached.append((lo, -(hi - lo), hi, entry["filters"]))
+
+    covered = start
+    for lo, span, hi, filters in sorted(cached, key=lambda c: c[:3]):
+        if lo < covered:
+            continue
+        if lo > covered:
+            logging.warning(f"No cached {table} data from {covered} to {lo}")
+        yield from query(table, filters)
+        covered = hi
+
+    if covered < end:
+        logging.warning(f"No cached {table} data from {covered} to {end}")
+
+
+def _fetch(table, field, lo, hi, fmt):
+    # greater_than is exclusive, so ask for one second before the window start.
+    logging.debug(f"Querying {table} from {lo} to {hi}")
+    filters = between(
+        field, (lo - datetime.timedelta(seconds=1)).strftime(fmt), hi.strftime(fmt)
+    )
+    # Records are held back until the window is known not to need splitting,
+    # so a split never hands on the same records twice. Only a window too
+    # small to split streams past max_rows.
+    rows = 0
+    held = []
+    with closing(query(table, filters)) as records:
+        for record in records:
+            rows += 1
+            if held is None:
+                yield record
+                continue
+            held.append(record)
+            if rows > max_rows:
+                if hi - lo > min_window:
+                    raise WindowTooLarge(f"more than {max_rows} rows")
+                yield from held
+                held = None
+    if held:
+        yield from held
+    return rows